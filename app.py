@@ -1,103 +1,472 @@
 # app.py
+from __future__ import annotations
+
 import io
-import csv
+import os
 import json
+import time
+import logging
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
-import torch
 from fastapi import FastAPI, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-from torchvision import transforms
+from fastapi.responses import JSONResponse, PlainTextResponse
 
-from model import load_trained_model
+from cache import PredictionCache
+from metrics import REGISTRY, CallbackGauge, Counter, Histogram
+from plan_rules import TIER_GLOBAL, PlanRule, PlanRules, RuleIndex, load_plan_rules, load_rule_table
+from gym_models import load_flat_gym_models, load_gym_lookup, load_gym_models, predict_targets
 
-# NEW: for GYM models (recommendations)
-import pandas as pd
-from train2 import load_gym_models
+# torch / torchvision / PIL and the CNN modules are imported by
+# import_serving_deps() and pandas / sklearn only on the GYM fallback path,
+# so with PHYSIQUE_LAZY_STARTUP=1 none of them delay binding the port.
 
-# ---------------- Paths & device ----------------
+# ---------------- Paths ----------------
 
 BACKEND_ROOT = Path(__file__).resolve().parent
 DATA_DIR = BACKEND_ROOT / "data"
 WEIGHTS_PATH = BACKEND_ROOT / "weights" / "physique_cnn.pth"
 CLASS_MAPPING_PATH = DATA_DIR / "class_mapping.json"
 PLAN_RULES_PATH = DATA_DIR / "plan_rules.csv"
+RULE_TABLE_PATH = DATA_DIR / "plan_rule_table.npz"
+RULE_COLUMNS_DIR = DATA_DIR / "plan_rules_columns"
+
+# ---------------- Settings ----------------
+
+# Load models / rules on a background thread after startup instead of at
+# import; /ready reports 503 (and /analyze refuses work) until it is done.
+LAZY_STARTUP = os.environ.get("PHYSIQUE_LAZY_STARTUP", "0") == "1"
+
+# Serving backend (see inference.BACKENDS):
+#   eager (fp32, default) | int8 (quantize.py) | torchscript / onnx (export_model.py)
+BACKEND = os.environ.get("PHYSIQUE_BACKEND", "eager").lower()
+
+# NHWC batches + model weights; usually faster for convolutions on CPU
+CHANNELS_LAST = os.environ.get("PHYSIQUE_CHANNELS_LAST", "0") == "1"
+
+# torch.compile the eager model at startup (model.compile_model), compiled
+# for every batch size up to MAX_BATCH_SIZE before READY; falls back to the
+# plain model if compilation fails. Compiling takes tens of seconds on small hosts,
+# so pair it with LAZY_STARTUP where /ready matters.
+COMPILE = os.environ.get("PHYSIQUE_COMPILE", "0") == "1"
+COMPILE_MODE = os.environ.get("PHYSIQUE_COMPILE_MODE", "default")
+
+# Worker-pool mode: INFER_PROCESSES > 0 runs the CNN in that many separate
+# processes (THREADS_PER_PROCESS torch threads each, pinned to disjoint
+# cores) instead of in this process. 0 = single in-process MODEL.
+INFER_PROCESSES = int(os.environ.get("PHYSIQUE_INFER_PROCESSES", "0"))
+_threads_env = os.environ.get("PHYSIQUE_THREADS_PER_PROCESS")
+THREADS_PER_PROCESS = int(_threads_env) if _threads_env else None
+
+# Cross-request micro-batching: images from concurrent /analyze calls are
+# collected for up to BATCH_WINDOW_MS (or MAX_BATCH_SIZE images) and run
+# through MODEL in one forward pass.
+BATCH_WINDOW_MS = float(os.environ.get("PHYSIQUE_BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.environ.get("PHYSIQUE_MAX_BATCH_SIZE", "16"))
+
+# Reduced-resolution JPEG decode for uploads (see image_from_bytes)
+JPEG_DRAFT = os.environ.get("PHYSIQUE_JPEG_DRAFT", "1") != "0"
+
+# Per-image probabilities keyed by a hash of the upload bytes, so re-submitted
+# photos skip decode + CNN. CACHE_SIZE=0 and no CACHE_DB disables it.
+CACHE_SIZE = int(os.environ.get("PHYSIQUE_CACHE_SIZE", "1024"))
+CACHE_TTL_SECONDS = float(os.environ.get("PHYSIQUE_CACHE_TTL", "3600"))
+CACHE_DB = os.environ.get("PHYSIQUE_CACHE_DB")  # optional SQLite file
+
+# Warm-up before READY: WARMUP_ROUNDS passes of synthetic batches of each
+# size in WARMUP_BATCH_SIZES through the batcher + model, then the
+# post-CNN stages, so the first real request doesn't pay for cold kernels,
+# allocator and thread pools. WARMUP_ROUNDS=0 disables it.
+WARMUP_ROUNDS = int(os.environ.get("PHYSIQUE_WARMUP_ROUNDS", "2"))
+WARMUP_BATCH_SIZES = [
+    int(n) for n in os.environ.get("PHYSIQUE_WARMUP_BATCH_SIZES", f"1,3,{MAX_BATCH_SIZE}").split(",") if n.strip()
+]
+
+# Per-request details (confidences, matched rules, GYM labels) are logged
+# at DEBUG; PHYSIQUE_LOG_LEVEL=DEBUG brings back the old per-request printout.
+LOGGER = logging.getLogger("physique")
+LOGGER.setLevel(os.environ.get("PHYSIQUE_LOG_LEVEL", "INFO").upper())
+if not LOGGER.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("[%(name)s] %(message)s"))
+    LOGGER.addHandler(_handler)
+
+# ---------------- Metrics ----------------
+
+# Exported on /metrics (Prometheus text format). Histogram.observe is a
+# bisect + two adds, cheap enough to stay on in production; the gauges
+# are only evaluated when /metrics is scraped.
+STAGE_SECONDS = Histogram(
+    "physique_stage_seconds",
+    "Time per /analyze stage (decode, preprocess, forward, analysis, rules, workout_plan, meal_guide, gym)",
+    labelnames=("stage",),
+)
+REQUEST_SECONDS = Histogram("physique_request_seconds", "End-to-end /analyze latency")
+BATCH_SIZE = Histogram(
+    "physique_batch_size",
+    "Images per CNN forward pass",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64),
+)
+ANALYZE_TOTAL = Counter("physique_analyze_total", "/analyze requests by outcome", labelnames=("result",))
+CallbackGauge("physique_ready", "1 once models are loaded and warmed up", lambda: int(READY.is_set()))
+CallbackGauge(
+    "physique_batch_queue_depth",
+    "Images waiting for a forward pass",
+    lambda: BATCHER.queue_depth() if BATCHER is not None else None,
+)
+CallbackGauge(
+    "physique_prediction_cache_lookups_total",
+    "Prediction cache lookups by result",
+    lambda: {k: PREDICTION_CACHE.stats()[k] for k in ("hits", "disk_hits", "misses")},
+    labelname="result",
+    type="counter",
+)
+CallbackGauge(
+    "physique_prediction_cache_hit_ratio",
+    "Fraction of prediction cache lookups answered from the cache",
+    lambda: PREDICTION_CACHE.stats()["hit_rate"],
+)
+CallbackGauge(
+    "physique_prediction_cache_entries",
+    "Entries in the in-memory prediction cache",
+    lambda: PREDICTION_CACHE.stats()["entries"],
+)
 
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"[app.py] Inference device: {DEVICE}")
+# ---------------- Serving state ----------------
+
+# Filled in by load_serving_state(): at import by default, on a background
+# thread with LAZY_STARTUP. READY is set once all of it is usable.
+DEVICE = None
+IDX_TO_CLASS: Dict[int, str] = {}
+NUM_CLASSES = 0
+MODEL = None
+SERVED_BACKEND = BACKEND  # BACKEND, or "eager" if its export is stale
+MODEL_PATH = None         # the file SERVED_BACKEND loads
+INFER_POOL = None
+INFER_TRANSFORMS = None
+BATCH_BUFFER = None
+BATCHER = None
+PREDICTION_CACHE: Optional[PredictionCache] = None
+PLAN_RULES: Optional[PlanRules] = None
+RULE_INDEX: Optional[RuleIndex] = None
+RULE_TABLE = None
+GYM_FLAT = None
+EXERCISE_MODEL = None
+MEAL_MODEL = None
+GYM_META = None
+GYM_FEATURE_COLS: List[str] = []
+GYM_LOOKUP = None
+
+READY = threading.Event()
+STARTUP_ERROR: Optional[str] = None
+STARTUP_SECONDS: Optional[float] = None
+WARMUP_SECONDS: Optional[float] = None
+
+
+def import_serving_deps():
+    """The heavy imports (torch, torchvision via model.py, PIL), as module globals."""
+    global torch, Image, IMG_SIZE, Preprocessor, resize_to_uint8
+    global InferenceBatcher, ProcessInferencePool, load_backend_model, resolve_backend, compile_model
+    import torch
+    from PIL import Image
+
+    from preprocess import IMG_SIZE, Preprocessor, resize_to_uint8
+    from inference import InferenceBatcher, ProcessInferencePool, load_backend_model, resolve_backend
+    from model import compile_model
 
-# ---------------- Class mapping ----------------
 
-if not CLASS_MAPPING_PATH.exists():
-    raise RuntimeError(
-        f"class_mapping.json not found at {CLASS_MAPPING_PATH}. "
-        f"Run train.py first."
-    )
+# ---------------- CNN Model ----------------
 
-with CLASS_MAPPING_PATH.open("r", encoding="utf-8") as f:
-    class_to_idx: Dict[str, int] = json.load(f)
+def load_cnn():
+    global DEVICE, IDX_TO_CLASS, NUM_CLASSES, MODEL, INFER_POOL, INFER_TRANSFORMS, BATCH_BUFFER
+    global SERVED_BACKEND, MODEL_PATH
 
-IDX_TO_CLASS = {idx: name for name, idx in class_to_idx.items()}
-NUM_CLASSES = len(IDX_TO_CLASS)
+    DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"[app.py] Inference device: {DEVICE}")
 
-# ---------------- CNN Model ----------------
+    # ----- class mapping -----
 
-if not WEIGHTS_PATH.exists():
-    raise RuntimeError(
-        f"Model weights not found at {WEIGHTS_PATH}. "
-        f"Train the model with train.py first."
-    )
+    if not CLASS_MAPPING_PATH.exists():
+        raise RuntimeError(
+            f"class_mapping.json not found at {CLASS_MAPPING_PATH}. "
+            f"Run train.py first."
+        )
 
-print(f"[app.py] Using weights: {WEIGHTS_PATH}")
-MODEL = load_trained_model(str(WEIGHTS_PATH), NUM_CLASSES, DEVICE)
+    with CLASS_MAPPING_PATH.open("r", encoding="utf-8") as f:
+        class_to_idx: Dict[str, int] = json.load(f)
 
-IMG_SIZE = 224
-INFER_TRANSFORMS = transforms.Compose([
-    transforms.Resize((IMG_SIZE, IMG_SIZE)),
-    transforms.ToTensor(),
-    transforms.Normalize(
-        mean=[0.485, 0.456, 0.406],
-        std=[0.229, 0.224, 0.225],
-    ),
-])
+    IDX_TO_CLASS = {idx: name for name, idx in class_to_idx.items()}
+    NUM_CLASSES = len(IDX_TO_CLASS)
 
-# ---------------- Load CSV rules ----------------
+    # ----- weights / backend -----
 
-if not PLAN_RULES_PATH.exists():
-    raise RuntimeError(
-        f"plan_rules.csv not found at {PLAN_RULES_PATH}. "
-        f"Run generate_plan_rules.py first to create it."
+    if not WEIGHTS_PATH.exists():
+        raise RuntimeError(
+            f"Model weights not found at {WEIGHTS_PATH}. "
+            f"Train the model with train.py first."
+        )
+
+    print(f"[app.py] Using weights: {WEIGHTS_PATH}")
+
+    # an export not built from this physique_cnn.pth is never served
+    SERVED_BACKEND, MODEL_PATH = resolve_backend(BACKEND, str(WEIGHTS_PATH))
+
+    if SERVED_BACKEND == "int8" and DEVICE.type != "cpu":
+        print("[app.py] int8 backend is CPU-only, switching inference device to cpu")
+        DEVICE = torch.device("cpu")
+    print(f"[app.py] Inference backend: {SERVED_BACKEND} ({MODEL_PATH.name})")
+
+    if INFER_PROCESSES > 0 and DEVICE.type == "cpu":
+        MODEL = None
+        INFER_POOL = ProcessInferencePool(
+            str(MODEL_PATH),
+            NUM_CLASSES,
+            processes=INFER_PROCESSES,
+            threads_per_process=THREADS_PER_PROCESS,
+            backend=SERVED_BACKEND,
+            compile_mode=COMPILE_MODE if COMPILE else None,
+            channels_last=CHANNELS_LAST,
+        )
+        INFER_POOL.warm()
+        print(f"[app.py] Inference worker pool: {INFER_POOL.processes} processes x "
+              f"{INFER_POOL.threads_per_process} threads")
+    else:
+        INFER_POOL = None
+        if THREADS_PER_PROCESS:
+            torch.set_num_threads(THREADS_PER_PROCESS)
+        MODEL = load_backend_model(SERVED_BACKEND, str(MODEL_PATH), NUM_CLASSES, DEVICE)
+        if CHANNELS_LAST and isinstance(MODEL, torch.nn.Module) and SERVED_BACKEND != "torchscript":
+            MODEL = MODEL.to(memory_format=torch.channels_last)
+
+    # Same preprocessing as training (preprocess.py). Uploads are only resized
+    # to uint8 on CPU_POOL; the float conversion + normalization happen once per
+    # batch, straight into BATCH_BUFFER (see collate_batch).
+    INFER_TRANSFORMS = Preprocessor(channels_last=CHANNELS_LAST)
+    BATCH_BUFFER = INFER_TRANSFORMS.new_buffer(MAX_BATCH_SIZE)
+
+    if COMPILE and MODEL is not None:
+        if SERVED_BACKEND == "eager":
+            # 1 is specialized; 2 then MAX_BATCH_SIZE makes the batch dim
+            # dynamic, so the batcher thread never has to recompile
+            examples = [
+                INFER_TRANSFORMS.new_buffer(n).zero_().to(DEVICE)
+                for n in sorted({1, 2, MAX_BATCH_SIZE})
+            ]
+            MODEL = compile_model(MODEL, examples, mode=COMPILE_MODE)
+        else:
+            print(f"[app.py] PHYSIQUE_COMPILE only applies to the eager backend, not {SERVED_BACKEND}")
+
+
+def start_batcher():
+    global BATCHER
+
+    BATCHER = InferenceBatcher(
+        timed_pool_forward if INFER_POOL is not None else forward_batch,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_wait_ms=BATCH_WINDOW_MS,
+        max_in_flight=INFER_POOL.processes if INFER_POOL is not None else 1,
+        collate=collate_batch,
     )
+    print(f"[app.py] Micro-batching: window={BATCH_WINDOW_MS}ms, max_batch={MAX_BATCH_SIZE}")
+
+# ---------------- Prediction cache ----------------
+
+def load_prediction_cache():
+    global PREDICTION_CACHE
+
+    if CACHE_SIZE > 0 or CACHE_DB:
+        # results depend on the model actually served (backend + the file it
+        # loaded, which may be an export rather than physique_cnn.pth) and
+        # on the decode path
+        model_stat = MODEL_PATH.stat()
+        PREDICTION_CACHE = PredictionCache(
+            max_entries=CACHE_SIZE,
+            ttl_seconds=CACHE_TTL_SECONDS,
+            sqlite_path=CACHE_DB,
+            namespace=(f"{SERVED_BACKEND}:{MODEL_PATH.name}:{model_stat.st_mtime_ns}:"
+                       f"{model_stat.st_size}:{JPEG_DRAFT}"),
+        )
+        print(f"[app.py] Prediction cache: {CACHE_SIZE} entries, ttl={CACHE_TTL_SECONDS}s, "
+              f"sqlite={CACHE_DB or 'off'}")
+    else:
+        PREDICTION_CACHE = None
 
-PLAN_RULES: List[Dict[str, Any]] = []
-with PLAN_RULES_PATH.open("r", encoding="utf-8") as f:
-    reader = csv.DictReader(f)
-    for row in reader:
-        row["id"] = int(row["id"])
-        row["overall_min_score"] = float(row["overall_min_score"])
-        row["overall_max_score"] = float(row["overall_max_score"])
-        PLAN_RULES.append(row)
+# ---------------- Load CSV rules ----------------
+
+def load_rules():
+    global PLAN_RULES, RULE_INDEX, RULE_TABLE
+
+    if not PLAN_RULES_PATH.exists():
+        raise RuntimeError(
+            f"plan_rules.csv not found at {PLAN_RULES_PATH}. "
+            f"Run generate_plan_rules.py first to create it."
+        )
 
-print(f"[app.py] Loaded {len(PLAN_RULES)} plan rules from {PLAN_RULES_PATH}")
+    # columnar, memory-mapped from data/plan_rules_columns/ when compiled
+    # (`python plan_rules.py compile`); rows read like dicts: rule["workout_title"]
+    PLAN_RULES = load_plan_rules(PLAN_RULES_PATH, RULE_COLUMNS_DIR)
+
+    print(f"[app.py] Loaded {len(PLAN_RULES)} plan rules from {PLAN_RULES_PATH}")
+
+    # hash-map + interval index over PLAN_RULES for _select_rule_for_muscle
+    RULE_INDEX = RuleIndex(PLAN_RULES)
+
+    # precomputed answer for every input combination (`python plan_rules.py build`);
+    # RULE_INDEX covers anything outside it
+    RULE_TABLE = load_rule_table(PLAN_RULES_PATH, RULE_TABLE_PATH)
+    if RULE_TABLE is not None:
+        print(f"[app.py] Loaded plan rule table {RULE_TABLE.positions.shape} from {RULE_TABLE_PATH}")
+    else:
+        print(f"[app.py] No up-to-date {RULE_TABLE_PATH.name}; selecting rules with RuleIndex")
 
 # ---------------- GYM.csv-based recommendation models ----------------
 
-try:
-    EXERCISE_MODEL, MEAL_MODEL, GYM_META = load_gym_models()
-    GYM_FEATURE_COLS = GYM_META["feature_cols"]
-    print(f"[app.py] Loaded GYM recommendation models. Features: {GYM_FEATURE_COLS}")
-except Exception as e:
-    EXERCISE_MODEL = None
-    MEAL_MODEL = None
-    GYM_META = None
-    GYM_FEATURE_COLS = []
-    print(f"[app.py] WARNING: Could not load GYM models: {e}")
+def load_gym():
+    global GYM_FLAT, EXERCISE_MODEL, MEAL_MODEL, GYM_META, GYM_FEATURE_COLS, GYM_LOOKUP
+
+    # flat NumPy export of the same forests (`python gym_models.py export`):
+    # memory-mapped, loads in milliseconds and predicts without sklearn/pandas.
+    # The pickled pipelines are only unpickled when it is missing or stale.
+    GYM_FLAT = load_flat_gym_models()
+    if GYM_FLAT is not None:
+        EXERCISE_MODEL = None
+        MEAL_MODEL = None
+        GYM_META = None
+        GYM_FEATURE_COLS = GYM_FLAT.feature_cols
+        print(f"[app.py] Loaded flat GYM recommendation models. Features: {GYM_FEATURE_COLS}")
+    else:
+        try:
+            EXERCISE_MODEL, MEAL_MODEL, GYM_META = load_gym_models()
+            GYM_FEATURE_COLS = GYM_META["feature_cols"]
+            print(f"[app.py] Loaded GYM recommendation models. Features: {GYM_FEATURE_COLS}")
+        except Exception as e:
+            EXERCISE_MODEL = None
+            MEAL_MODEL = None
+            GYM_META = None
+            GYM_FEATURE_COLS = []
+            print(f"[app.py] WARNING: Could not load GYM models: {e}")
+
+    # precomputed answers for every known feature combination (train2.py compiles it);
+    # the models above are only called for values outside it
+    GYM_LOOKUP = load_gym_lookup()
+    if GYM_LOOKUP is not None:
+        print(f"[app.py] Loaded GYM lookup table with {len(GYM_LOOKUP)} combinations")
+    else:
+        print("[app.py] No up-to-date gym_lookup.json; GYM recommendations use the models")
+
+# ---------------- Warm-up ----------------
+
+WARMUP_PREFS = {
+    "goal": "muscle gain",
+    "experience": "beginner",
+    "equipment": "gym",
+    "time": "45-60 min",
+    "gender": "male",
+    "bmiCategory": "Normal",
+}
+
+
+def warm_up():
+    """
+    Run synthetic work through every stage of /analyze: JPEG decode +
+    resize, batches of the production sizes through BATCHER (collate +
+    MODEL or the worker pool), and build_analysis_response. Bypasses
+    PREDICTION_CACHE, so nothing synthetic is ever served.
+    """
+    global WARMUP_SECONDS
+
+    if WARMUP_ROUNDS <= 0:
+        return
+    start = time.perf_counter()
+
+    buf = io.BytesIO()
+    Image.new("RGB", (4 * IMG_SIZE, 4 * IMG_SIZE), (128, 128, 128)).save(buf, "JPEG")
+    preprocess_image_bytes(buf.getvalue())
+
+    generator = torch.Generator().manual_seed(0)
+    for _ in range(WARMUP_ROUNDS):
+        for size in WARMUP_BATCH_SIZES:
+            images = [
+                torch.randint(0, 256, (IMG_SIZE, IMG_SIZE, 3), dtype=torch.uint8, generator=generator)
+                for _ in range(size)
+            ]
+            for future in BATCHER.submit(images):
+                future.result()
+
+    # confident synthetic predictions, so the rule / meal / GYM stages run too
+    class_names = list(IDX_TO_CLASS.values())
+    for r in range(WARMUP_ROUNDS):
+        dominant = class_names[r % len(class_names)]
+        preds = {name: (0.9 if name == dominant else 0.1 / (len(class_names) - 1)) for name in class_names}
+        build_analysis_response(preds, preds, preds, WARMUP_PREFS)
+
+    WARMUP_SECONDS = time.perf_counter() - start
+    # only real traffic in the latency histograms; warm-up never touches
+    # ANALYZE_TOTAL, so requests served before READY keep their counts
+    for histogram in (STAGE_SECONDS, REQUEST_SECONDS, BATCH_SIZE):
+        histogram.reset()
+    print(f"[app.py] Warm-up: {WARMUP_ROUNDS} rounds of batch sizes {WARMUP_BATCH_SIZES} "
+          f"in {WARMUP_SECONDS:.2f}s")
+
+# ---------------- Startup ----------------
+
+def load_serving_state():
+    """Everything /analyze needs, in dependency order; sets READY at the end."""
+    global STARTUP_SECONDS
+
+    start = time.perf_counter()
+    import_serving_deps()
+    load_cnn()
+    load_prediction_cache()
+    start_batcher()
+    load_rules()
+    load_gym()
+    warm_up()
+    STARTUP_SECONDS = time.perf_counter() - start
+    READY.set()
+    print(f"[app.py] Ready after {STARTUP_SECONDS:.2f}s of loading")
+
+
+def _load_in_background():
+    global STARTUP_ERROR
+    try:
+        load_serving_state()
+    except Exception as e:
+        STARTUP_ERROR = f"{type(e).__name__}: {e}"
+        print(f"[app.py] ERROR: startup failed: {STARTUP_ERROR}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the port is already bound here; the loading happens next to it
+    if LAZY_STARTUP and not READY.is_set():
+        threading.Thread(target=_load_in_background, name="physique-startup", daemon=True).start()
+    yield
+
+# ---------------- CPU worker pool ----------------
+
+# Decode, preprocessing and the sklearn/rule stages are CPU-bound, so they
+# run on this bounded pool instead of the asyncio event loop. That keeps
+# uvicorn accepting connections (and answering "/") while requests compute.
+CPU_WORKERS = int(os.environ.get("PHYSIQUE_CPU_WORKERS", str(min(8, os.cpu_count() or 1))))
+CPU_POOL = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="physique-cpu")
+print(f"[app.py] CPU worker pool: {CPU_WORKERS} threads")
+
+
+async def run_in_cpu_pool(fn, *args, **kwargs):
+    """Run a blocking function on CPU_POOL and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(CPU_POOL, functools.partial(fn, *args, **kwargs))
 
 # ---------------- FastAPI setup ----------------
 
-app = FastAPI(title="Physique Check API")
+app = FastAPI(title="Physique Check API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -109,26 +478,120 @@ app.add_middleware(
 
 # ---------------- Helper functions ----------------
 
+def image_from_bytes(data: bytes) -> Image.Image:
+    """
+    Decode raw upload bytes into an RGB PIL Image.
+
+    With JPEG_DRAFT on, JPEGs are decoded at reduced resolution (libjpeg
+    DCT scaling by 1/2, 1/4 or 1/8) while both sides stay >= IMG_SIZE, so a
+    48 MP phone photo never gets fully decoded just to be resized to 224.
+    """
+    img = Image.open(io.BytesIO(data))
+    if JPEG_DRAFT:
+        img.draft("RGB", (IMG_SIZE, IMG_SIZE))  # no-op for non-JPEG formats
+    return img.convert("RGB")
+
+
 def file_to_image_bytes(upload: UploadFile) -> Image.Image:
-    """Read UploadFile into a PIL Image."""
-    data = upload.file.read()
-    img = Image.open(io.BytesIO(data)).convert("RGB")
-    return img
+    """Read UploadFile into a PIL Image (blocking; prefer `await upload.read()`)."""
+    return image_from_bytes(upload.file.read())
+
+
+def preprocess_image_bytes(data: bytes) -> torch.Tensor:
+    """Decode + resize one upload to a uint8 HWC tensor. Runs on CPU_POOL."""
+    with STAGE_SECONDS.time("decode"):
+        return resize_to_uint8(image_from_bytes(data), IMG_SIZE)
+
+
+def collate_batch(images: List[torch.Tensor]) -> torch.Tensor:
+    """Normalize queued uint8 images into the reused BATCH_BUFFER (batcher thread only)."""
+    BATCH_SIZE.observe(len(images))
+    with STAGE_SECONDS.time("preprocess"):
+        return INFER_TRANSFORMS.normalize_into(BATCH_BUFFER, images)
+
+
+def forward_batch(batch: torch.Tensor):
+    """Run MODEL on a [N, 3, 224, 224] batch and return softmax probs [N, C]."""
+    with STAGE_SECONDS.time("forward"), torch.no_grad():
+        logits = MODEL(batch.to(DEVICE))
+        return torch.softmax(logits, dim=1).cpu().numpy()
+
+
+def timed_pool_forward(batch: torch.Tensor):
+    """INFER_POOL.forward, observing the forward time when the worker's result arrives."""
+    start = time.perf_counter()
+    future = INFER_POOL.forward(batch)
+    future.add_done_callback(lambda _: STAGE_SECONDS.observe(time.perf_counter() - start, "forward"))
+    return future
+
+
+def probs_to_dict(probs) -> Dict[str, float]:
+    """Turn a probability vector into {class_name: probability}."""
+    return {IDX_TO_CLASS[i]: float(probs[i]) for i in range(NUM_CLASSES)}
+
+
+def run_model_on_images(imgs: List[Image.Image]) -> List[Dict[str, float]]:
+    """
+    Run CNN on several PIL images and return one {class_name: probability}
+    dict per image.
+
+    The images go through the shared BATCHER, so they end up in the same
+    forward pass as each other (and as any other in-flight request).
+    """
+    futures = BATCHER.submit([resize_to_uint8(img, IMG_SIZE) for img in imgs])
+    return [probs_to_dict(f.result()) for f in futures]
+
+
+async def run_model_on_tensors_async(tensors: List[torch.Tensor]) -> List[Dict[str, float]]:
+    """Submit uint8 image tensors to BATCHER and await the results without blocking the loop."""
+    futures = BATCHER.submit(tensors)
+    probs = await asyncio.gather(*[asyncio.wrap_future(f) for f in futures])
+    return [probs_to_dict(p) for p in probs]
+
+
+def _cache_lookup(uploads: List[bytes]):
+    """Hash each upload and look it up in PREDICTION_CACHE. Runs on CPU_POOL."""
+    keys = [PREDICTION_CACHE.key_for(data) for data in uploads]
+    return keys, [PREDICTION_CACHE.get(key) for key in keys]
+
+
+def _cache_store(items):
+    """PREDICTION_CACHE.put_many (SQLite write + commit). Runs on CPU_POOL."""
+    PREDICTION_CACHE.put_many(items)
+
+
+async def predict_uploads(uploads: List[bytes]) -> List[Dict[str, float]]:
+    """
+    Class probabilities for each raw upload. Cached images are answered
+    from PREDICTION_CACHE; only the misses are decoded and sent to BATCHER.
+    """
+    if PREDICTION_CACHE is not None:
+        keys, preds = await run_in_cpu_pool(_cache_lookup, uploads)
+    else:
+        keys, preds = [None] * len(uploads), [None] * len(uploads)
+
+    missing = [i for i, p in enumerate(preds) if p is None]
+    if missing:
+        tensors = await asyncio.gather(
+            *[run_in_cpu_pool(preprocess_image_bytes, uploads[i]) for i in missing]
+        )
+        fresh = await run_model_on_tensors_async(list(tensors))
+        for i, p in zip(missing, fresh):
+            preds[i] = p
+        if PREDICTION_CACHE is not None:
+            await run_in_cpu_pool(_cache_store, [(keys[i], preds[i]) for i in missing])
+
+    return preds
 
 
 def run_model_on_image(img: Image.Image) -> Dict[str, float]:
     """Run CNN on a PIL image and return probability per class_name."""
-    MODEL.eval()
-    with torch.no_grad():
-        tensor = INFER_TRANSFORMS(img).unsqueeze(0).to(DEVICE)
-        logits = MODEL(tensor)[0]
-        probs = torch.softmax(logits, dim=0).cpu().numpy()
-        return {IDX_TO_CLASS[i]: float(probs[i]) for i in range(NUM_CLASSES)}
+    return run_model_on_images([img])[0]
 
 
 def combine_predictions(pred_list: List[Dict[str, float]]) -> Dict[str, float]:
     """Average probabilities from multiple images."""
-    combined: Dict[str, float] = {name: 0.0 for name in class_to_idx.keys()}
+    combined: Dict[str, float] = {name: 0.0 for name in IDX_TO_CLASS.values()}
     if not pred_list:
         return combined
     for preds in pred_list:
@@ -300,51 +763,89 @@ def sets_for_experience(base_sets: int, experience: str) -> str:
 
 # ---------- GYM.csv recommendation helper ----------
 
-def gym_recommendations_from_prefs(prefs: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Use the models trained on GYM.csv to recommend:
-      - Exercise Schedule
-      - Meal Plan label/type
-    """
-    if EXERCISE_MODEL is None or MEAL_MODEL is None:
-        return {
-            "exerciseSchedule": None,
-            "mealPlanLabel": None,
-        }
+GYM_GOAL_MAP = {
+    "fat loss": "Weight Loss",
+    "weight loss": "Weight Loss",
+    "muscle gain": "Muscle Gain",
+    "recomposition": "Recomposition",
+    "maintain": "Maintain",
+}
+
 
+def _gym_feature_key(prefs: Dict[str, Any]) -> tuple:
+    """Model input for one preference record, as a tuple in GYM_FEATURE_COLS order."""
     gender = prefs.get("gender", "Male")
     goal_raw = prefs.get("goal", "muscle gain")
     bmi_cat = prefs.get("bmiCategory", "Normal")
 
-    goal_map = {
-        "fat loss": "Weight Loss",
-        "weight loss": "Weight Loss",
-        "muscle gain": "Muscle Gain",
-        "recomposition": "Recomposition",
-        "maintain": "Maintain",
-    }
-    goal = goal_map.get(str(goal_raw).lower(), str(goal_raw))
+    goal = GYM_GOAL_MAP.get(str(goal_raw).lower(), str(goal_raw))
 
     row = {
         "Gender": str(gender).title(),
         "Goal": goal,
         "BMI Category": str(bmi_cat),
     }
+    # feature columns the prefs don't cover are passed as None, like before
+    return tuple(row.get(col) for col in GYM_FEATURE_COLS)
 
-    df = pd.DataFrame([row])
 
-    for col in GYM_FEATURE_COLS:
-        if col not in df.columns:
-            df[col] = None
-    df = df[GYM_FEATURE_COLS]
+def _predict_gym_keys(keys: List[tuple]) -> List[tuple]:
+    """
+    (exercise schedule, meal plan) for each key: one predict call per model,
+    or a single one for a multi-output bundle.
+    """
+    if GYM_FLAT is not None:
+        exercise, meal = GYM_FLAT.predict_targets(keys)
+        return [(str(ex), str(me)) for ex, me in zip(exercise, meal)]
 
-    exercise_schedule = str(EXERCISE_MODEL.predict(df)[0])
-    meal_plan_label = str(MEAL_MODEL.predict(df)[0])
+    import pandas as pd
 
-    return {
-        "exerciseSchedule": exercise_schedule,
-        "mealPlanLabel": meal_plan_label,
-    }
+    df = pd.DataFrame(keys, columns=GYM_FEATURE_COLS)
+    exercise, meal = predict_targets(GYM_META, df)
+    return [(str(ex), str(me)) for ex, me in zip(exercise, meal)]
+
+
+def gym_recommendations_batch(prefs_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    gym_recommendations_from_prefs for many preference records at once
+    (e.g. re-scoring stored profiles).
+
+    Identical feature tuples are resolved once: from GYM_LOOKUP when
+    possible, the rest with a single vectorized predict per model. The
+    cost grows with the number of UNIQUE combinations, not of records.
+    """
+    if GYM_FLAT is None and (EXERCISE_MODEL is None or MEAL_MODEL is None):
+        return [{"exerciseSchedule": None, "mealPlanLabel": None} for _ in prefs_list]
+
+    keys = [_gym_feature_key(prefs) for prefs in prefs_list]
+
+    answers: Dict[tuple, tuple] = {}
+    misses: List[tuple] = []
+    for key in dict.fromkeys(keys):
+        hit = GYM_LOOKUP.get(key) if GYM_LOOKUP is not None else None
+        if hit is not None:
+            answers[key] = hit
+        else:
+            misses.append(key)
+    if misses:
+        answers.update(zip(misses, _predict_gym_keys(misses)))
+
+    return [
+        {
+            "exerciseSchedule": answers[key][0],
+            "mealPlanLabel": answers[key][1],
+        }
+        for key in keys
+    ]
+
+
+def gym_recommendations_from_prefs(prefs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Use the models trained on GYM.csv to recommend:
+      - Exercise Schedule
+      - Meal Plan label/type
+    """
+    return gym_recommendations_batch([prefs])[0]
 
 # -------------- CSV-based rule selection helpers --------------
 
@@ -374,10 +875,10 @@ def _select_rule_for_muscle(
     muscle_score: float,
     overall_score: float,
     prefs: Dict[str, Any],
-) -> Dict[str, Any]:
+) -> PlanRule:
     """
     Internal helper: pick one best CSV rule for a SINGLE muscle.
-    Used by select_rules_for_all_weak.
+    Used by select_rules_for_all_weak. Tiers are described in plan_rules.py.
     """
     strength_level = score_to_strength_level(muscle_score)
 
@@ -387,68 +888,23 @@ def _select_rule_for_muscle(
     equipment_for_rules = "home" if equipment_mode == "minimal" else equipment_mode
     time_slot = map_time_slot(prefs.get("time", "30-45 min"))
 
-    print(f"[_select_rule_for_muscle] muscle={muscle_name}, "
-          f"score={muscle_score}, strength_level={strength_level}, "
-          f"goal={goal}, experience={experience}, equipment={equipment_for_rules}, "
-          f"time_slot={time_slot}, overall_score={overall_score}")
-
-    def matches_full(row):
-        return (
-            row["muscle_group"] == muscle_name
-            and row["strength_level"] == strength_level
-            and row["goal"] == goal
-            and row["experience"] == experience
-            and row["equipment"] == equipment_for_rules
-            and row["time_slot"] == time_slot
-            and row["overall_min_score"] <= overall_score <= row["overall_max_score"]
-        )
-
-    candidates = [r for r in PLAN_RULES if matches_full(r)]
-    if candidates:
-        chosen = candidates[0]
-        print(f"  -> matched FULL rule id={chosen['id']} for {muscle_name}")
-        return chosen
-
-    def matches_no_time(row):
-        return (
-            row["muscle_group"] == muscle_name
-            and row["strength_level"] == strength_level
-            and row["goal"] == goal
-            and row["experience"] == experience
-            and row["equipment"] == equipment_for_rules
-            and row["overall_min_score"] <= overall_score <= row["overall_max_score"]
-        )
-
-    candidates = [r for r in PLAN_RULES if matches_no_time(r)]
-    if candidates:
-        chosen = candidates[0]
-        print(f"  -> matched NO-TIME rule id={chosen['id']} for {muscle_name}")
-        return chosen
-
-    def matches_loose(row):
-        return (
-            row["muscle_group"] == muscle_name
-            and row["goal"] == goal
-            and row["experience"] == experience
-            and row["equipment"] == equipment_for_rules
+    key = (muscle_name, strength_level, goal, experience, equipment_for_rules, time_slot, overall_score)
+    hit = RULE_TABLE.lookup(*key) if RULE_TABLE is not None else None
+    pos, tier = hit if hit is not None else RULE_INDEX.select(*key)
+    chosen = PLAN_RULES[pos]
+
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug(
+            "_select_rule_for_muscle: muscle=%s score=%s strength_level=%s goal=%s "
+            "experience=%s equipment=%s time_slot=%s overall_score=%s -> %s rule id=%s%s",
+            muscle_name, muscle_score, strength_level, goal, experience,
+            equipment_for_rules, time_slot, overall_score, tier, chosen["id"],
+            " (no good match at all, global fallback)" if tier == TIER_GLOBAL else "",
         )
+    return chosen
 
-    candidates = [r for r in PLAN_RULES if matches_loose(r)]
-    if candidates:
-        chosen = candidates[0]
-        print(f"  -> matched LOOSE rule id={chosen['id']} for {muscle_name}")
-        return chosen
 
-    for r in PLAN_RULES:
-        if r["muscle_group"] == muscle_name:
-            print(f"  -> fallback rule (same muscle) id={r['id']} for {muscle_name}")
-            return r
-
-    print("  -> no good match at all, using first rule as global fallback")
-    return PLAN_RULES[0]
-
-
-def select_rules_for_all_weak(analysis: Dict[str, Any], prefs: Dict[str, Any]) -> List[Dict[str, Any]]:
+def select_rules_for_all_weak(analysis: Dict[str, Any], prefs: Dict[str, Any]) -> List[PlanRule]:
     """
     Instead of only the single weakest muscle, choose rules for
     EVERY weak muscle (score <= 5). If nothing is <= 5, take the
@@ -473,7 +929,7 @@ def select_rules_for_all_weak(analysis: Dict[str, Any], prefs: Dict[str, Any]) -
             for name, info in sorted_muscles[:3]
         ]
 
-    rules: List[Dict[str, Any]] = []
+    rules: List[PlanRule] = []
     seen_ids = set()
 
     for muscle_name, score in weak_muscles:
@@ -482,8 +938,9 @@ def select_rules_for_all_weak(analysis: Dict[str, Any], prefs: Dict[str, Any]) -
             seen_ids.add(rule["id"])
             rules.append(rule)
 
-    print("[select_rules_for_all_weak] muscles covered:",
-          ", ".join([r["muscle_group"] for r in rules]))
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("select_rules_for_all_weak: muscles covered: %s",
+                     ", ".join([r["muscle_group"] for r in rules]))
     return rules
 
 # ---------- Equipment-based base exercises (gym vs home vs minimal) ----------
@@ -589,7 +1046,7 @@ BASE_EXERCISES = {
 }
 
 def workout_plan_from_rules(
-    rules: List[Dict[str, Any]],
+    rules: List[PlanRule],
     analysis: Dict[str, Any],
     prefs: Dict[str, Any],
 ) -> Dict[str, Any]:
@@ -840,16 +1297,42 @@ async def analyze_physique(
     preferences: str = Form(...),
 ):
     """Main endpoint used by the frontend."""
+    start = time.perf_counter()
+    if not READY.is_set():
+        ANALYZE_TOTAL.inc("not_ready")
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Models are still loading, retry shortly."},
+            headers={"Retry-After": "1"},
+        )
+
     prefs = json.loads(preferences)
 
-    front_img = file_to_image_bytes(front)
-    back_img = file_to_image_bytes(back)
-    legs_img = file_to_image_bytes(legs)
+    # async I/O on the event loop, hashing/decode/transforms on CPU_POOL.
+    # Uncached views go to the batcher together (one forward pass,
+    # possibly shared with other concurrent requests).
+    uploads = await asyncio.gather(front.read(), back.read(), legs.read())
+    preds_front, preds_back, preds_legs = await predict_uploads(list(uploads))
+
+    response = await run_in_cpu_pool(
+        build_analysis_response, preds_front, preds_back, preds_legs, prefs
+    )
+
+    ANALYZE_TOTAL.inc("ok" if response["validImages"] else "invalid_images")
+    REQUEST_SECONDS.observe(time.perf_counter() - start)
+    return response
 
-    preds_front = run_model_on_image(front_img)
-    preds_back = run_model_on_image(back_img)
-    preds_legs = run_model_on_image(legs_img)
 
+def build_analysis_response(
+    preds_front: Dict[str, float],
+    preds_back: Dict[str, float],
+    preds_legs: Dict[str, float],
+    prefs: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Everything after the CNN: confidence checks, scoring, rule selection,
+    meal guide and GYM predictions. Blocking, so /analyze runs it on CPU_POOL.
+    """
     # Helper to get top class + confidence
     def top_class(preds: Dict[str, float]):
         if not preds:
@@ -902,33 +1385,35 @@ async def analyze_physique(
         }
 
     # 3) normal analysis pipeline (only if passes all confidence checks)
-    combined_probs = combine_predictions([preds_front, preds_back, preds_legs])
-    analysis = analysis_from_probs(combined_probs)
+    with STAGE_SECONDS.time("analysis"):
+        combined_probs = combine_predictions([preds_front, preds_back, preds_legs])
+        analysis = analysis_from_probs(combined_probs)
 
     overall_score = float(analysis["physiqueRating"]["overallScore"])
 
-    rules = select_rules_for_all_weak(analysis, prefs)
-    workout_plan = workout_plan_from_rules(rules, analysis, prefs)
+    with STAGE_SECONDS.time("rules"):
+        rules = select_rules_for_all_weak(analysis, prefs)
+    with STAGE_SECONDS.time("workout_plan"):
+        workout_plan = workout_plan_from_rules(rules, analysis, prefs)
 
     primary_rule = rules[0]
-    meal_guide = meal_guide_from_rule(primary_rule, prefs)
+    with STAGE_SECONDS.time("meal_guide"):
+        meal_guide = meal_guide_from_rule(primary_rule, prefs)
 
-    gym_recos = gym_recommendations_from_prefs(prefs)
+    with STAGE_SECONDS.time("gym"):
+        gym_recos = gym_recommendations_from_prefs(prefs)
     workout_plan["recommendedSchedule"] = gym_recos["exerciseSchedule"]
     meal_guide["gymMealPlanLabel"] = gym_recos["mealPlanLabel"]
 
     c_top, c_conf = top_class(combined_probs)
 
-    print("========== /analyze request ==========")
-    print(f"Front   top: {f_top:15s} conf={f_conf:.3f}")
-    print(f"Back    top: {b_top:15s} conf={b_conf:.3f}")
-    print(f"Legs    top: {l_top:15s} conf={l_conf:.3f}")
-    print(f"Avg confidence of 3 images: {avg_conf:.3f}")
-    print(f"Overall physique score (1–10): {overall_score}")
-    print(f"Matched rule ids={[r['id'] for r in rules]} "
-          f"muscles={[r['muscle_group'] for r in rules]}")
-    print("GYM recommendations:", gym_recos)
-    print("======================================")
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug(
+            "/analyze: front=%s (%.3f) back=%s (%.3f) legs=%s (%.3f) avg_conf=%.3f "
+            "overall=%s rule_ids=%s muscles=%s gym=%s",
+            f_top, f_conf, b_top, b_conf, l_top, l_conf, avg_conf, overall_score,
+            [r["id"] for r in rules], [r["muscle_group"] for r in rules], gym_recos,
+        )
 
     return {
         "validImages": True,
@@ -953,3 +1438,38 @@ async def analyze_physique(
 @app.get("/")
 def root():
     return {"status": "ok", "message": "Physique Check API running"}
+
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness probe for the load balancer, separate from the "/" liveness
+    check: 503 until load_serving_state() has finished loading and warming
+    up (or if it failed).
+    """
+    if READY.is_set():
+        return {"ready": True, "startupSeconds": STARTUP_SECONDS, "warmupSeconds": WARMUP_SECONDS}
+    return JSONResponse(
+        status_code=503,
+        content={"ready": False, "error": STARTUP_ERROR},
+    )
+
+
+@app.get("/metrics")
+def metrics():
+    """Per-stage latency histograms, batch sizes, cache and queue stats (Prometheus text format)."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit/miss counters of the per-image prediction cache."""
+    if PREDICTION_CACHE is None:
+        return {"enabled": False}
+    return {"enabled": True, **PREDICTION_CACHE.stats()}
+
+
+# ---------------- Load models ----------------
+
+if not LAZY_STARTUP:
+    load_serving_state()
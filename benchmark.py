@@ -0,0 +1,248 @@
+# benchmark.py
+"""
+Small microbenchmarks for the training / serving hot paths.
+
+Usage:
+    python benchmark.py preprocess [--images 64] [--batch 16] [--size 1200x1600]
+    python benchmark.py loader [--workers 0 2 auto] [--prefetch 2 4] [--epochs 2]
+    python benchmark.py compile [--batch 1 8 16] [--mode default] [--train]
+"""
+import argparse
+import contextlib
+import io
+import time
+from pathlib import Path
+from typing import Callable, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from preprocess import IMG_SIZE, MEAN, STD, Preprocessor, resize_to_uint8
+from utils import green
+
+
+# ---------- helpers ----------
+
+def parse_size(text: str) -> Tuple[int, int]:
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def time_it(fn: Callable[[], object], repeats: int) -> float:
+    """Best-of-`repeats` wall time of fn() in seconds (after one warm-up call)."""
+    fn()
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def random_images(count: int, size: Tuple[int, int], seed: int = 0):
+    rng = np.random.default_rng(seed)
+    w, h = size
+    return [
+        Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8))
+        for _ in range(count)
+    ]
+
+
+# ---------- preprocess ----------
+
+def old_compose() -> transforms.Compose:
+    """The Resize -> ToTensor -> Normalize pipeline Preprocessor replaced."""
+    return transforms.Compose([
+        transforms.Resize((IMG_SIZE, IMG_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=list(MEAN), std=list(STD)),
+    ])
+
+
+def _preprocess_timings(images, batch: int, repeats: int):
+    compose = old_compose()
+
+    def run_compose():
+        for i in range(0, len(images), batch):
+            torch.stack([compose(img) for img in images[i:i + batch]])
+
+    results = {"compose + stack": time_it(run_compose, repeats)}
+
+    for channels_last in (False, True):
+        fused = Preprocessor(channels_last=channels_last)
+        buf = fused.new_buffer(batch)
+
+        def run_fused():
+            for i in range(0, len(images), batch):
+                chunk = images[i:i + batch]
+                fused.normalize_into(buf, [resize_to_uint8(img) for img in chunk])
+
+        tag = "channels_last" if channels_last else "contiguous"
+        results[f"fused ({tag})"] = time_it(run_fused, repeats)
+
+    return results
+
+
+def bench_preprocess(args):
+    """Old Resize -> ToTensor -> Normalize Compose vs. the fused Preprocessor."""
+    images = random_images(args.images, parse_size(args.size))
+    # same images already at 224x224: isolates the to-float/normalize/stack part
+    resized = [img.resize((IMG_SIZE, IMG_SIZE), Image.BILINEAR) for img in images]
+
+    print(green(f"[benchmark] preprocess: {args.images} images, batch={args.batch}, "
+                f"threads={torch.get_num_threads()}"))
+    for title, imgs in (
+        (f"end-to-end from {args.size}", images),
+        (f"tensor stage only ({IMG_SIZE}x{IMG_SIZE} input)", resized),
+    ):
+        results = _preprocess_timings(imgs, args.batch, args.repeats)
+        base = results["compose + stack"]
+        print(f"  {title}:")
+        for name, secs in results.items():
+            print(f"    {name:24s} {secs * 1000:8.1f} ms  "
+                  f"{args.images / secs:9.1f} img/s  x{base / secs:.2f}")
+
+    # sanity check: both paths must produce the same numbers
+    compose = old_compose()
+    max_diff = (compose(images[0]) - Preprocessor()(images[0])).abs().max().item()
+    print(f"  max |compose - fused| = {max_diff:.2e}")
+
+
+# ---------- loader ----------
+
+def _loader_throughput(args, workers, prefetch: int, use_cache: bool) -> float:
+    """Images/sec of the train loader over args.epochs epochs (incl. worker start-up)."""
+    from dataset import get_dataloaders
+
+    with contextlib.redirect_stdout(io.StringIO()):  # get_dataloaders is chatty
+        loader = get_dataloaders(
+            data_root=str(args.data_root),
+            batch_size=args.batch,
+            num_workers=workers,
+            prefetch_factor=prefetch,
+            use_cache=use_cache,
+            split_seed=0,
+        )[0]
+    images = 0
+    start = time.perf_counter()
+    for _ in range(args.epochs):
+        for batch, _labels in loader:
+            images += batch.shape[0]
+    return images / (time.perf_counter() - start)
+
+
+def bench_loader(args):
+    """Train-loader throughput for each worker count / prefetch / image source."""
+    from dataset import auto_num_workers, load_image_cache
+
+    workers = [auto_num_workers() if w == "auto" else int(w) for w in args.workers]
+    sources = [False]
+    if load_image_cache(args.data_root) is not None:
+        sources.append(True)
+    else:
+        print("  (no up-to-date image cache; run `python dataset.py cache` to include it)")
+
+    print(green(f"[benchmark] loader: {args.data_root}, batch={args.batch}, epochs={args.epochs}, "
+                f"auto workers={auto_num_workers()}"))
+    print(f"    {'source':8s} {'workers':>7s} {'prefetch':>8s} {'img/s':>9s}")
+    for use_cache in sources:
+        for w in sorted(set(workers)):
+            for prefetch in (args.prefetch if w > 0 else [None]):
+                rate = _loader_throughput(args, w, prefetch, use_cache)
+                source = "cache" if use_cache else "jpeg"
+                print(f"    {source:8s} {w:7d} {str(prefetch or '-'):>8s} {rate:9.1f}")
+
+
+# ---------- compile ----------
+
+def bench_compile(args):
+    """Eager vs torch.compile PhysiqueCNN: compile cost and steady-state latency."""
+    from model import PhysiqueCNN, compile_model
+
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
+    batches = {
+        n: torch.randn(n, 3, IMG_SIZE, IMG_SIZE).contiguous(memory_format=memory_format)
+        for n in sorted(set(args.batch))
+    }
+
+    print(green(f"[benchmark] compile: mode={args.mode}, channels_last={args.channels_last}, "
+                f"threads={torch.get_num_threads()}"))
+
+    model = PhysiqueCNN(num_classes=10, pretrained=False).eval().to(memory_format=memory_format)
+    start = time.perf_counter()
+    compiled = compile_model(model, list(batches.values()), mode=args.mode)
+    compile_secs = time.perf_counter() - start
+    if compiled is model:
+        raise SystemExit("torch.compile is not available here (see the message above)")
+
+    print(f"  inference (compile + warm-up of {len(batches)} batch sizes: {compile_secs:.1f}s)")
+    print(f"    {'batch':>5s} {'eager ms':>9s} {'compiled ms':>11s} {'speedup':>8s} {'break-even calls':>17s}")
+    with torch.no_grad():
+        for n, x in batches.items():
+            eager = time_it(lambda: model(x), args.repeats)
+            fast = time_it(lambda: compiled(x), args.repeats)
+            gain = eager - fast
+            break_even = f"{compile_secs / gain:,.0f}" if gain > 0 else "never"
+            print(f"    {n:5d} {eager * 1000:9.1f} {fast * 1000:11.1f} {eager / fast:7.2f}x {break_even:>17s}")
+        diff = (model(x) - compiled(x)).abs().max().item()
+    print(f"  max |eager - compiled| logits = {diff:.2e}")
+
+    if args.train:
+        n = max(batches)
+        x, labels = batches[n], torch.randint(0, 10, (n,))
+        model = PhysiqueCNN(num_classes=10, pretrained=False).train().to(memory_format=memory_format)
+        start = time.perf_counter()
+        compiled = compile_model(model, [x], mode=args.mode, train=True)
+        compile_secs = time.perf_counter() - start
+
+        def step(net):
+            loss = torch.nn.functional.cross_entropy(net(x), labels)
+            loss.backward()
+
+        eager = time_it(lambda: step(model), args.repeats)
+        fast = time_it(lambda: step(compiled), args.repeats)
+        print(f"  train step, batch {n} (compile: {compile_secs:.1f}s): "
+              f"eager {eager * 1000:.1f} ms, compiled {fast * 1000:.1f} ms, x{eager / fast:.2f}")
+
+
+# ---------- main ----------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("preprocess", help="Compose vs fused preprocessing")
+    p.add_argument("--images", type=int, default=64)
+    p.add_argument("--batch", type=int, default=16)
+    p.add_argument("--size", default="1200x1600", help="source image WxH")
+    p.add_argument("--repeats", type=int, default=3)
+    p.set_defaults(func=bench_preprocess)
+
+    from dataset import DATA_ROOT
+
+    p = sub.add_parser("loader", help="DataLoader images/sec per workers / prefetch setting")
+    p.add_argument("--data-root", type=Path, default=DATA_ROOT)
+    p.add_argument("--workers", nargs="+", default=["0", "2", "auto"], help='worker counts, or "auto"')
+    p.add_argument("--prefetch", type=int, nargs="+", default=[2, 4])
+    p.add_argument("--batch", type=int, default=16)
+    p.add_argument("--epochs", type=int, default=2)
+    p.set_defaults(func=bench_loader)
+
+    from model import COMPILE_MODES
+
+    p = sub.add_parser("compile", help="eager vs torch.compile latency and compile cost")
+    p.add_argument("--batch", type=int, nargs="+", default=[1, 8, 16])
+    p.add_argument("--mode", default="default", choices=COMPILE_MODES)
+    p.add_argument("--channels-last", action="store_true")
+    p.add_argument("--train", action="store_true", help="also time a forward + backward step")
+    p.add_argument("--repeats", type=int, default=10)
+    p.set_defaults(func=bench_compile)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
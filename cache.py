@@ -0,0 +1,155 @@
+# cache.py
+"""
+Content-hash cache for per-image CNN results.
+
+Users often re-submit the same three photos with different preferences.
+PredictionCache keys the class probabilities of each image on a hash of
+the raw upload bytes, so those requests skip decode + forward entirely and
+only the cheap rule/meal stages run again.
+
+Two tiers:
+  - in-memory LRU with TTL (per process)
+  - optional SQLite file (shared by workers on the same host, survives restarts)
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+
+class PredictionCache:
+    """
+    Bounded LRU + TTL cache: key (hash of upload bytes) -> {class_name: prob}.
+
+    `namespace` is mixed into every key; app.py puts the backend and the
+    version of the model file it serves there, so retraining or re-exporting
+    never serves stale results.
+
+    Expired SQLite rows are deleted when the file is opened and then at most
+    once per `prune_interval` seconds from put(), not on every write.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        sqlite_path: Optional[str] = None,
+        namespace: str = "",
+        prune_interval: float = 60.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        self.namespace = namespace.encode("utf-8")
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, float]]]" = OrderedDict()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, timeout=5.0)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                " key TEXT PRIMARY KEY, probs TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            # pruning is a range delete on `created`, not a table scan
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS predictions_created ON predictions (created)"
+            )
+            self._prune(time.time())
+            self._db.commit()
+
+    # ---------- keys ----------
+
+    def key_for(self, data: bytes) -> str:
+        """Hash of the raw upload bytes (+ namespace)."""
+        h = hashlib.blake2b(digest_size=20)
+        h.update(self.namespace)
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    # ---------- get / put ----------
+
+    def get(self, key: str) -> Optional[Dict[str, float]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, probs = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(probs)
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT probs, created FROM predictions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    probs = json.loads(row[0])
+                    self._store(key, row[1], probs)
+                    self.disk_hits += 1
+                    return dict(probs)
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, probs: Dict[str, float]):
+        self.put_many([(key, probs)])
+
+    def put_many(self, items: Sequence[Tuple[str, Dict[str, float]]]):
+        """Store several results; with SQLite, in a single transaction."""
+        now = time.time()
+        with self._lock:
+            for key, probs in items:
+                self._store(key, now, dict(probs))
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO predictions (key, probs, created) VALUES (?, ?, ?)",
+                    [(key, json.dumps(probs), now) for key, probs in items],
+                )
+                if now - self._last_prune >= self.prune_interval:
+                    self._prune(now)
+                self._db.commit()
+
+    def _prune(self, now: float):
+        # caller holds self._lock (or is __init__) and commits
+        self._db.execute("DELETE FROM predictions WHERE created < ?", (now - self.ttl,))
+        self._last_prune = now
+
+    def _store(self, key: str, created: float, probs: Dict[str, float]):
+        # caller holds self._lock
+        self._entries[key] = (created, probs)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # ---------- stats ----------
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "sqlite": self._db is not None,
+            }
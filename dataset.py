@@ -1,32 +1,222 @@
 # dataset.py
+import argparse
+import json
+import os
+import time
 from pathlib import Path
-from typing import Tuple, Dict
+from typing import Any, Tuple, Dict, List, Optional, Union
 
+import numpy as np
 import torch
-from torch.utils.data import DataLoader, random_split
-from torchvision import datasets, transforms
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset, Subset, random_split
+from torchvision import datasets
 
+from preprocess import IMG_SIZE, Preprocessor, resize_to_uint8
+from utils import write_manifest
 
-IMG_SIZE = 224
 
+BACKEND_ROOT = Path(__file__).resolve().parent
+DATA_ROOT = BACKEND_ROOT / "data" / "dataset"
+IMAGE_CACHE_DIR = BACKEND_ROOT / "data" / "image_cache"
 
-def get_transforms() -> transforms.Compose:
-    """Basic transforms for training and validation."""
-    return transforms.Compose([
-        transforms.Resize((IMG_SIZE, IMG_SIZE)),
-        transforms.ToTensor(),
-        transforms.Normalize(
-            mean=[0.485, 0.456, 0.406],
-            std=[0.229, 0.224, 0.225],
-        ),
-    ])
+# num_workers="auto": one worker per available core, leaving one for the
+# training loop itself, capped (past ~8 workers decode is rarely the limit)
+MAX_AUTO_WORKERS = 8
+# batches each worker keeps ready ahead of the training loop
+AUTO_PREFETCH_FACTOR = 4
+
+
+def get_transforms() -> Preprocessor:
+    """
+    Transforms for training and validation.
+
+    Resize((224, 224)) + ToTensor + Normalize, fused (see preprocess.py).
+    app.py uses the same Preprocessor, so training and serving match.
+    """
+    return Preprocessor()
+
+
+def dataset_targets(dataset) -> torch.Tensor:
+    """
+    Labels of every sample as a LongTensor, without loading any image.
+
+    Works for ImageFolder (its .targets list) and for (nested) Subsets of it
+    such as the ones random_split returns. Anything else falls back to
+    indexing the dataset, which does decode each sample.
+    """
+    if isinstance(dataset, Subset):
+        parent = dataset_targets(dataset.dataset)
+        return parent[torch.as_tensor(dataset.indices, dtype=torch.long)]
+    targets = getattr(dataset, "targets", None)
+    if targets is not None:
+        return torch.as_tensor(targets, dtype=torch.long)
+    return torch.tensor([dataset[i][1] for i in range(len(dataset))], dtype=torch.long)
+
+
+def class_counts(dataset, num_classes: int) -> torch.Tensor:
+    """Number of samples per class (length num_classes), e.g. for class weights."""
+    return torch.bincount(dataset_targets(dataset), minlength=num_classes)
+
+
+# ---------------- pre-decoded image cache ----------------
+#
+# get_transforms() has no random augmentation, so every epoch decodes and
+# resizes exactly the same pixels. `python dataset.py cache` does that once:
+#
+#   image_cache/images.npy     uint8 [N, IMG_SIZE, IMG_SIZE, 3] (memory-mapped)
+#   image_cache/labels.npy     int64 [N]
+#   image_cache/manifest.json  classes + (path, size, mtime) of every source
+#                              image, in ImageFolder order, for invalidation
+#
+# CachedImageDataset then only does the uint8 -> normalized float step.
+
+
+def _source_files(folder: datasets.ImageFolder, root: Path) -> List[list]:
+    """[relative path, size, mtime_ns] of every image, in ImageFolder order."""
+    files = []
+    for path, _ in folder.samples:
+        st = os.stat(path)
+        files.append([Path(path).relative_to(root).as_posix(), st.st_size, st.st_mtime_ns])
+    return files
+
+
+def build_image_cache(
+    data_root: Path = DATA_ROOT,
+    cache_dir: Path = IMAGE_CACHE_DIR,
+    size: int = IMG_SIZE,
+) -> int:
+    """Decode + resize every image under data_root once into cache_dir. Returns N."""
+    root = Path(data_root)
+    folder = datasets.ImageFolder(root=root)
+    if len(folder) == 0:
+        raise RuntimeError(f"No images found in dataset root: {root}")
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = cache_dir / "manifest.json"
+    if manifest_path.exists():
+        manifest_path.unlink()  # the old cache is invalid from here on
+
+    files = _source_files(folder, root)
+    images = np.lib.format.open_memmap(
+        cache_dir / "images.npy", mode="w+", dtype=np.uint8, shape=(len(folder), size, size, 3),
+    )
+    for i, (path, _) in enumerate(folder.samples):
+        with Image.open(path) as img:
+            images[i] = resize_to_uint8(img, size).numpy()
+    images.flush()
+    del images
+    np.save(cache_dir / "labels.npy", np.asarray(folder.targets, dtype=np.int64))
+
+    write_manifest(manifest_path, {
+        "size": size,
+        "classes": folder.classes,
+        "class_to_idx": folder.class_to_idx,
+        "files": files,
+    }, indent=None)
+    return len(folder)
+
+
+class CachedImageDataset(Dataset):
+    """
+    ImageFolder drop-in served from a build_image_cache() directory.
+
+    Items are (normalized float CHW tensor, label), identical to what
+    ImageFolder + get_transforms() returns. The uint8 pixels are a zero-copy
+    view into the memory-mapped images.npy; only the normalized output is
+    allocated. `.targets`, `.classes` and `.class_to_idx` match ImageFolder.
+    """
+
+    def __init__(self, cache_dir: Path = IMAGE_CACHE_DIR, transform: Optional[Preprocessor] = None):
+        self.cache_dir = Path(cache_dir)
+        with (self.cache_dir / "manifest.json").open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.size = manifest["size"]
+        self.classes = manifest["classes"]
+        self.class_to_idx = manifest["class_to_idx"]
+        self.files = manifest["files"]
+        self.targets = np.load(self.cache_dir / "labels.npy", allow_pickle=False).tolist()
+        self.transform = transform if transform is not None else Preprocessor(size=self.size)
+        self._images = None
+
+    @property
+    def images(self) -> np.ndarray:
+        # opened lazily so DataLoader workers each map the file themselves
+        # instead of receiving a pickled copy of the whole array
+        if self._images is None:
+            # copy-on-write: writable for torch.from_numpy, never written back
+            self._images = np.load(self.cache_dir / "images.npy", mmap_mode="c", allow_pickle=False)
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __getitem__(self, idx: int):
+        img = torch.from_numpy(self.images[idx])
+        return self.transform.normalize(img), self.targets[idx]
+
+
+def load_image_cache(data_root: Path = DATA_ROOT, cache_dir: Path = IMAGE_CACHE_DIR) -> Optional[CachedImageDataset]:
+    """
+    The cached dataset if cache_dir matches the images currently under
+    data_root (same files, sizes and mtimes), otherwise None.
+    """
+    if not (cache_dir / "manifest.json").exists():
+        return None
+    dataset = CachedImageDataset(cache_dir)
+    root = Path(data_root)
+    if dataset.size != IMG_SIZE or dataset.files != _source_files(datasets.ImageFolder(root=root), root):
+        print(f"[PhysiqueDataset] {cache_dir.name} is stale (images changed); "
+              f"run `python dataset.py cache`")
+        return None
+    return dataset
+
+
+# ---------------- DataLoader settings ----------------
+
+def auto_num_workers() -> int:
+    """Loader workers for this machine: available cores - 1, at most MAX_AUTO_WORKERS."""
+    try:
+        cores = len(os.sched_getaffinity(0))  # respects taskset / container CPU limits
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(0, min(MAX_AUTO_WORKERS, cores - 1))
+
+
+def loader_kwargs(num_workers: Union[int, str] = "auto", prefetch_factor: Optional[int] = None) -> Dict[str, Any]:
+    """
+    DataLoader keyword arguments for `num_workers` (an int, or "auto").
+
+    With workers, they are persistent (no process start-up every epoch) and
+    keep `prefetch_factor` batches queued each. Memory is only pinned when
+    there is a CUDA device to copy to; on CPU it is pure overhead.
+    """
+    if num_workers == "auto":
+        num_workers = auto_num_workers()
+    kwargs: Dict[str, Any] = {
+        "num_workers": num_workers,
+        "pin_memory": torch.cuda.is_available(),
+    }
+    if num_workers > 0:
+        kwargs["persistent_workers"] = True
+        kwargs["prefetch_factor"] = prefetch_factor or AUTO_PREFETCH_FACTOR
+    return kwargs
 
 
 def get_dataloaders(
     data_root: str,
     batch_size: int = 16,
     val_split: float = 0.2,
-    num_workers: int = 0,
+    num_workers: Union[int, str] = 0,
+    split_seed: Optional[int] = None,
+    use_cache: bool = False,
+    cache_dir: Path = IMAGE_CACHE_DIR,
+    prefetch_factor: Optional[int] = None,
 ) -> Tuple[DataLoader, DataLoader, int, Dict[str, int], torch.utils.data.Dataset, torch.utils.data.Dataset]:
     """
     Load dataset from folder structure like:
@@ -38,6 +228,12 @@ def get_dataloaders(
           ...
 
     Returns train/val dataloaders, number of classes and class mapping.
+    Pass split_seed to get the same train/val split every time (e.g. to
+    evaluate on the exact validation split train.py used).
+    With use_cache=True the images come from the pre-decoded cache in
+    cache_dir when it is up to date (same samples, same split).
+    num_workers="auto" sizes the loader workers to the machine (see
+    loader_kwargs for the prefetch / pinning settings).
     """
     root = Path(data_root)
     print(f"Loading dataset from: {root}")
@@ -47,7 +243,12 @@ def get_dataloaders(
 
     transform = get_transforms()
 
-    full_dataset = datasets.ImageFolder(root=root, transform=transform)
+    full_dataset = load_image_cache(root, cache_dir) if use_cache else None
+    if full_dataset is not None:
+        full_dataset.transform = transform
+        print(f"[PhysiqueDataset] Using pre-decoded image cache: {cache_dir}")
+    else:
+        full_dataset = datasets.ImageFolder(root=root, transform=transform)
 
     if len(full_dataset) == 0:
         # Print classes we *thought* we saw to help debugging
@@ -65,27 +266,69 @@ def get_dataloaders(
     # train/val split
     val_size = int(len(full_dataset) * val_split)
     train_size = len(full_dataset) - val_size
-    train_dataset, val_dataset = random_split(full_dataset, [train_size, val_size])
+    generator = torch.Generator().manual_seed(split_seed) if split_seed is not None else None
+    if generator is not None:
+        train_dataset, val_dataset = random_split(full_dataset, [train_size, val_size], generator=generator)
+    else:
+        train_dataset, val_dataset = random_split(full_dataset, [train_size, val_size])
 
     print(f"[DataLoader] Train samples: {len(train_dataset)}, Val samples: {len(val_dataset)}")
 
     # dataloaders
+    kwargs = loader_kwargs(num_workers, prefetch_factor)
+    print(f"[DataLoader] workers={kwargs['num_workers']}, "
+          f"prefetch_factor={kwargs.get('prefetch_factor')}, pin_memory={kwargs['pin_memory']}")
+
     train_loader = DataLoader(
         train_dataset,
         batch_size=batch_size,
         shuffle=True,
-        num_workers=num_workers,
-        pin_memory=True,
+        **kwargs,
     )
 
     val_loader = DataLoader(
         val_dataset,
         batch_size=batch_size,
         shuffle=False,
-        num_workers=num_workers,
-        pin_memory=True,
+        **kwargs,
     )
 
     class_to_idx = full_dataset.class_to_idx
 
     return train_loader, val_loader, num_classes, class_to_idx, train_dataset, val_dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build / check the pre-decoded image cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help in (("cache", f"decode + resize every image into {IMAGE_CACHE_DIR.name}/"),
+                       ("verify", "compare the cache with ImageFolder + get_transforms()")):
+        p = sub.add_parser(name, help=help)
+        p.add_argument("--data-root", type=Path, default=DATA_ROOT)
+        p.add_argument("--cache-dir", type=Path, default=IMAGE_CACHE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "cache":
+        start = time.perf_counter()
+        n = build_image_cache(args.data_root, args.cache_dir)
+        size = (args.cache_dir / "images.npy").stat().st_size
+        print(f"[PhysiqueDataset] cached {n} images, {size / 1e6:.1f} MB "
+              f"in {time.perf_counter() - start:.1f}s -> {args.cache_dir}")
+    else:
+        cached = load_image_cache(args.data_root, args.cache_dir)
+        if cached is None:
+            raise SystemExit(f"No up-to-date cache in {args.cache_dir}; run `python dataset.py cache` first.")
+        folder = datasets.ImageFolder(root=args.data_root, transform=get_transforms())
+        mismatches = 0
+        for i in range(len(folder)):
+            (want, want_label), (got, got_label) = folder[i], cached[i]
+            if want_label != got_label or not torch.equal(want, got):
+                mismatches += 1
+                print(f"  MISMATCH {cached.files[i][0]}")
+        print(f"[PhysiqueDataset] verified {len(folder)} images: {mismatches} mismatches")
+        if mismatches:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
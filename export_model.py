@@ -0,0 +1,116 @@
+# export_model.py
+"""
+Export the trained PhysiqueCNN to inference-only formats next to
+weights/physique_cnn.pth:
+
+  - weights/physique_cnn.torchscript.pt   frozen + optimized TorchScript
+  - weights/physique_cnn.onnx             ONNX (dynamic batch size)
+
+and check that both give the same outputs as the eager model.
+
+Serve them with:
+    PHYSIQUE_BACKEND=torchscript uvicorn app:app
+    PHYSIQUE_BACKEND=onnx uvicorn app:app      (needs `pip install onnxruntime`)
+
+Usage:
+    python export_model.py [--format torchscript|onnx|all] [--opset 17]
+"""
+import argparse
+import json
+
+import torch
+
+from model import load_trained_model, onnx_path, torchscript_path, write_source_manifest
+from preprocess import IMG_SIZE
+from train import CLASS_MAPPING_PATH, WEIGHTS_PATH
+from utils import file_sha256, green
+
+
+def export_torchscript(model: torch.nn.Module, example: torch.Tensor, source_sha256: str):
+    path = torchscript_path(str(WEIGHTS_PATH))
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        # freeze inlines parameters as constants and folds conv-bn. The
+        # CPU-specific optimize_for_inference pass is applied at load time
+        # (inference.load_backend_model): its prepacked weights can't be saved.
+        frozen = torch.jit.freeze(traced)
+    frozen.save(str(path))
+    write_source_manifest(path, WEIGHTS_PATH, source_sha256)
+    print(green(f"[export] TorchScript saved to {path}"))
+    return path
+
+
+def export_onnx(model: torch.nn.Module, example: torch.Tensor, opset: int, source_sha256: str):
+    path = onnx_path(str(WEIGHTS_PATH))
+    kwargs = dict(
+        input_names=["images"],
+        output_names=["logits"],
+        dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+        do_constant_folding=True,
+    )
+    with torch.no_grad():
+        try:
+            # newer torch defaults to the dynamo exporter; keep the classic one
+            torch.onnx.export(model, (example,), str(path), dynamo=False, **kwargs)
+        except TypeError:
+            torch.onnx.export(model, (example,), str(path), **kwargs)
+    write_source_manifest(path, WEIGHTS_PATH, source_sha256)
+    print(green(f"[export] ONNX saved to {path}"))
+    return path
+
+
+def check_backend(name: str, num_classes: int, reference: torch.Tensor, batch: torch.Tensor):
+    """Load an exported artifact through the serving code path and compare logits."""
+    from inference import load_backend_model, resolve_backend
+
+    backend, path = resolve_backend(name, str(WEIGHTS_PATH))
+    if backend != name:
+        print(f"  {name:12s} FAILED: the export would not be served (source manifest mismatch)")
+        return
+    try:
+        model = load_backend_model(backend, str(path), num_classes, torch.device("cpu"))
+    except RuntimeError as e:
+        print(f"  {name:12s} skipped ({e})")
+        return
+    with torch.no_grad():
+        out = model(batch)
+    max_diff = (out - reference).abs().max().item()
+    print(f"  {name:12s} max |logits - eager| = {max_diff:.2e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export physique_cnn.pth for inference")
+    parser.add_argument("--format", choices=["torchscript", "onnx", "all"], default="all")
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    if not WEIGHTS_PATH.exists():
+        raise RuntimeError(f"Model weights not found at {WEIGHTS_PATH}. Train with train.py first.")
+
+    with CLASS_MAPPING_PATH.open("r", encoding="utf-8") as f:
+        num_classes = len(json.load(f))
+
+    source_sha256 = file_sha256(WEIGHTS_PATH)  # of the exact file loaded here
+    model = load_trained_model(str(WEIGHTS_PATH), num_classes, torch.device("cpu"))
+    example = torch.randn(1, 3, IMG_SIZE, IMG_SIZE)
+
+    backends = []
+    if args.format in ("torchscript", "all"):
+        export_torchscript(model, example, source_sha256)
+        backends.append("torchscript")
+    if args.format in ("onnx", "all"):
+        export_onnx(model, example, args.opset, source_sha256)
+        backends.append("onnx")
+
+    # check with a different batch size than the export example
+    batch = torch.randn(3, 3, IMG_SIZE, IMG_SIZE)
+    with torch.no_grad():
+        reference = model(batch)
+    print(green("[export] Checking exported models against eager:"))
+    for name in backends:
+        check_backend(name, num_classes, reference, batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+# gym_models.py
+"""
+Serving-side loaders for the GYM.csv recommenders trained by train2.py
+(which re-exports them), plus a fast-loading form of the forests.
+
+Importing this module only costs NumPy; joblib / sklearn are imported
+inside load_gym_models when the pickled pipelines are really needed.
+
+Unpickling two 300-tree RandomForest pipelines at app.py import is slow and
+every uvicorn worker ends up with its own copy. `export` flattens each
+fitted forest into a handful of NumPy node arrays:
+
+  feature, threshold, left, right   one entry per node, all trees back to back
+  leaf_proba                        class probabilities per node (n_nodes, outputs, classes)
+  roots                             first node of every tree
+
+plus the one-hot categories / scaler statistics of the preprocessing step,
+and writes them to weights/gym_forest/. FlatForestModels memory-maps that
+directory and predicts with plain NumPy (no sklearn, no pandas): the same
+float32-input / float64-threshold comparisons and the same tree-order
+probability average as RandomForestClassifier, so predictions are identical.
+
+Usage:
+    python gym_models.py export   # weights/gym_tabular_models.pkl -> weights/gym_forest/
+    python gym_models.py verify   # compare with the sklearn pipelines on every known combination
+"""
+import argparse
+import itertools
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils import file_sha256, write_manifest
+
+
+BACKEND_ROOT = Path(__file__).resolve().parent
+WEIGHTS_DIR = BACKEND_ROOT / "weights"
+GYM_MODEL_PATH = WEIGHTS_DIR / "gym_tabular_models.pkl"
+GYM_FOREST_DIR = WEIGHTS_DIR / "gym_forest"
+# every feature combination -> (Exercise Schedule, Meal Plan), compiled by train2.py
+GYM_LOOKUP_PATH = WEIGHTS_DIR / "gym_lookup.json"
+
+NODE_ARRAYS = ("feature", "threshold", "left", "right", "leaf_proba", "roots")
+
+
+# ---------------- pickled pipelines / lookup table ----------------
+
+def load_gym_models(weights_path: Optional[str] = None):
+    """
+    Load the trained GYM tabular models (joblib + sklearn, imported here
+    on demand so importing this module stays cheap).
+
+    Returns:
+        exercise_model: sklearn Pipeline predicting 'Exercise Schedule'
+        meal_model:     sklearn Pipeline predicting 'Meal Plan'
+        meta:           full metadata bundle (dict)
+
+    For a multi-output bundle (train2.py --multi-output) the two models are
+    TargetView wrappers over the shared pipeline in meta["model"]; use
+    predict_targets(meta, X) to get both targets from one predict.
+    """
+    import joblib
+
+    if weights_path is None:
+        path = GYM_MODEL_PATH
+    else:
+        path = Path(weights_path)
+
+    if not path.exists():
+        raise FileNotFoundError(
+            f"Gym models not found at {path}. Run train2.py first."
+        )
+
+    bundle = joblib.load(path)
+    if bundle.get("multi_output"):
+        model = bundle["model"]
+        return TargetView(model, 0), TargetView(model, 1), bundle
+    return bundle["exercise_model"], bundle["meal_model"], bundle
+
+
+def load_gym_lookup(
+    lookup_path: Optional[str] = None,
+    models_path: Optional[str] = None,
+) -> Optional[Dict[Tuple[str, ...], Tuple[str, str]]]:
+    """
+    Load gym_lookup.json as {feature values tuple: (exercise schedule, meal plan)}.
+
+    Returns None if it is missing or was compiled from a different
+    gym_tabular_models.pkl (run `python train2.py --compile-lookup`).
+    """
+    lookup_path = GYM_LOOKUP_PATH if lookup_path is None else Path(lookup_path)
+    models_path = GYM_MODEL_PATH if models_path is None else Path(models_path)
+    if not lookup_path.exists() or not models_path.exists():
+        return None
+
+    with lookup_path.open("r", encoding="utf-8") as f:
+        lookup = json.load(f)
+    if lookup["models_sha256"] != file_sha256(models_path):
+        print(f"[gym_models] {lookup_path.name} is stale ({models_path.name} changed); "
+              f"run `python train2.py --compile-lookup`")
+        return None
+
+    n = len(lookup["feature_cols"])
+    return {tuple(e[:n]): (e[n], e[n + 1]) for e in lookup["entries"]}
+
+
+class TargetView:
+    """One target of a multi-output pipeline, behind the single-target predict()."""
+
+    def __init__(self, model, index: int):
+        self.model = model
+        self.index = index
+
+    def predict(self, X):
+        return self.model.predict(X)[:, self.index]
+
+
+def predict_targets(bundle: dict, X) -> Tuple[np.ndarray, np.ndarray]:
+    """(exercise schedule, meal plan) predictions for a DataFrame X, for either bundle layout."""
+    if bundle.get("multi_output"):
+        Y = bundle["model"].predict(X)
+        return Y[:, 0], Y[:, 1]
+    return bundle["exercise_model"].predict(X), bundle["meal_model"].predict(X)
+
+
+# ---------------- export (needs sklearn / joblib) ----------------
+
+def _export_encoder(pipeline) -> Dict:
+    """Column layout of the pipeline's ColumnTransformer as plain JSON data."""
+    numeric, categorical = [], []
+    for name, transformer, cols in pipeline.named_steps["preprocess"].transformers_:
+        if name == "num" and len(cols):
+            scaler = transformer.named_steps["scaler"]
+            numeric = [
+                {"col": c, "mean": float(m), "scale": float(s)}
+                for c, m, s in zip(cols, scaler.mean_, scaler.scale_)
+            ]
+        elif name == "cat":
+            onehot = transformer.named_steps["onehot"]
+            if onehot.handle_unknown != "ignore" or onehot.drop is not None:
+                raise ValueError(f"Unsupported OneHotEncoder settings: {onehot}")
+            categorical = [
+                {"col": c, "categories": [str(v) for v in cats]}
+                for c, cats in zip(cols, onehot.categories_)
+            ]
+        elif name != "remainder" and len(cols):
+            raise ValueError(f"Unsupported preprocessing step {name!r}")
+    return {"numeric": numeric, "categorical": categorical}
+
+
+def _flatten_forest(forest) -> Dict[str, np.ndarray]:
+    """Concatenate the node arrays of every tree of a fitted forest."""
+    n_outputs = forest.n_outputs_
+    n_classes = np.atleast_1d(forest.n_classes_)
+    max_classes = int(n_classes.max())
+
+    parts = {name: [] for name in NODE_ARRAYS}
+    offset = 0
+    for est in forest.estimators_:
+        tree = est.tree_
+        n = tree.node_count
+        leaf = tree.children_left == -1
+
+        parts["feature"].append(np.where(leaf, 0, tree.feature).astype(np.int32))
+        parts["threshold"].append(tree.threshold.astype(np.float64))
+        # leaves point at themselves, so traversal can run a fixed number of steps
+        self_idx = np.arange(offset, offset + n, dtype=np.int32)
+        parts["left"].append(np.where(leaf, self_idx, tree.children_left + offset).astype(np.int32))
+        parts["right"].append(np.where(leaf, self_idx, tree.children_right + offset).astype(np.int32))
+
+        proba = np.zeros((n, n_outputs, max_classes), dtype=np.float64)
+        for k in range(n_outputs):
+            value = tree.value[:, k, :n_classes[k]]
+            sums = value.sum(axis=1, keepdims=True)
+            if not np.allclose(sums, 1.0):
+                # older sklearn stores counts and normalizes in predict_proba
+                sums[sums == 0.0] = 1.0
+                value = value / sums
+            proba[:, k, :n_classes[k]] = value
+        parts["leaf_proba"].append(proba)
+        parts["roots"].append(np.array([offset], dtype=np.int32))
+        offset += n
+
+    flat = {name: np.concatenate(arrays) for name, arrays in parts.items()}
+    flat["depth"] = max(est.tree_.max_depth for est in forest.estimators_)
+    return flat
+
+
+def export_gym_models(models_path: Path = GYM_MODEL_PATH, out_dir: Path = GYM_FOREST_DIR) -> Path:
+    """Write the flat NumPy form of every forest in the bundle to out_dir."""
+    import joblib
+
+    bundle = joblib.load(models_path)
+    if bundle.get("multi_output"):
+        pipelines = {"multi": bundle["model"]}
+        targets = {"multi": list(bundle["target_cols"])}
+    else:
+        pipelines = {"exercise": bundle["exercise_model"], "meal": bundle["meal_model"]}
+        targets = {"exercise": [bundle["exercise_target_col"]], "meal": [bundle["meal_target_col"]]}
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for old in [out_dir / "manifest.json", *out_dir.glob("*.npy")]:
+        old.unlink(missing_ok=True)
+    models = {}
+    for name, pipeline in pipelines.items():
+        forest = pipeline.named_steps["clf"]
+        flat = _flatten_forest(forest)
+        for array in NODE_ARRAYS:
+            np.save(out_dir / f"{name}.{array}.npy", flat[array])
+        classes = forest.classes_ if forest.n_outputs_ > 1 else [forest.classes_]
+        models[name] = {
+            "encoder": _export_encoder(pipeline),
+            "targets": targets[name],
+            "classes": [[str(c) for c in cls] for cls in classes],
+            "n_trees": len(forest.estimators_),
+            "depth": int(flat["depth"]),
+        }
+
+    write_manifest(out_dir / "manifest.json", {
+        "feature_cols": list(bundle["feature_cols"]),
+        "multi_output": bool(bundle.get("multi_output")),
+        "models": models,
+        "models_sha256": file_sha256(models_path),
+    }, indent=1)
+    return out_dir
+
+
+# ---------------- pure-NumPy predictor ----------------
+
+class FlatForest:
+    """One exported forest + its preprocessing, predicting from feature tuples."""
+
+    def __init__(self, spec: Dict, arrays: Dict[str, np.ndarray], feature_cols: Sequence[str]):
+        self.targets = spec["targets"]
+        self.classes = [np.asarray(c, dtype=object) for c in spec["classes"]]
+        self.n_trees = spec["n_trees"]
+        self.depth = spec["depth"]
+        for name in NODE_ARRAYS:
+            setattr(self, name, arrays[name])
+
+        col_pos = {c: i for i, c in enumerate(feature_cols)}
+        enc = spec["encoder"]
+        # same column order as the ColumnTransformer output: numeric, then one-hot blocks
+        self._numeric = [(col_pos[n["col"]], n["mean"], n["scale"]) for n in enc["numeric"]]
+        self._onehot = []
+        offset = len(self._numeric)
+        for c in enc["categorical"]:
+            codes = {v: offset + j for j, v in enumerate(c["categories"])}
+            self._onehot.append((col_pos[c["col"]], codes))
+            offset += len(codes)
+        self.n_features = offset
+
+    def encode(self, rows: Sequence[tuple]) -> np.ndarray:
+        """Feature tuples -> float32 model input (unknown categories -> all zeros)."""
+        X = np.zeros((len(rows), self.n_features), dtype=np.float64)
+        for i, row in enumerate(rows):
+            for j, (pos, mean, scale) in enumerate(self._numeric):
+                X[i, j] = (float(row[pos]) - mean) / scale
+            for pos, codes in self._onehot:
+                col = codes.get(None if row[pos] is None else str(row[pos]))
+                if col is not None:
+                    X[i, col] = 1.0
+        # sklearn trees compare float32 inputs against float64 thresholds
+        return X.astype(np.float32)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Averaged class probabilities, (n_samples, n_outputs, max_classes)."""
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], self.n_trees)).copy()
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        # accumulate tree by tree, like RandomForestClassifier.predict_proba
+        proba = np.zeros((X.shape[0],) + self.leaf_proba.shape[1:], dtype=np.float64)
+        for t in range(self.n_trees):
+            proba += self.leaf_proba[nodes[:, t]]
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, rows: Sequence[tuple]) -> List[np.ndarray]:
+        """One array of class labels per target."""
+        proba = self.predict_proba(self.encode(rows))
+        return [
+            classes.take(np.argmax(proba[:, k, :len(classes)], axis=1))
+            for k, classes in enumerate(self.classes)
+        ]
+
+
+class FlatForestModels:
+    """The exported bundle: both GYM targets from raw feature tuples."""
+
+    def __init__(self, manifest: Dict, forests: Dict[str, FlatForest]):
+        self.manifest = manifest
+        self.feature_cols = manifest["feature_cols"]
+        self.models_sha256 = manifest["models_sha256"]
+        self.forests = forests
+
+    @classmethod
+    def load(cls, directory: Path = GYM_FOREST_DIR, mmap: bool = True) -> "FlatForestModels":
+        mode = "r" if mmap else None
+        with (directory / "manifest.json").open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        forests = {}
+        for name, spec in manifest["models"].items():
+            arrays = {
+                array: np.load(directory / f"{name}.{array}.npy", mmap_mode=mode, allow_pickle=False)
+                for array in NODE_ARRAYS
+            }
+            forests[name] = FlatForest(spec, arrays, manifest["feature_cols"])
+        return cls(manifest, forests)
+
+    def predict_targets(self, rows: Sequence[tuple]) -> Tuple[np.ndarray, np.ndarray]:
+        """(exercise schedule, meal plan) labels for feature tuples in feature_cols order."""
+        if self.manifest["multi_output"]:
+            exercise, meal = self.forests["multi"].predict(rows)
+        else:
+            (exercise,) = self.forests["exercise"].predict(rows)
+            (meal,) = self.forests["meal"].predict(rows)
+        return exercise, meal
+
+
+def load_flat_gym_models(
+    forest_dir: Path = GYM_FOREST_DIR,
+    models_path: Path = GYM_MODEL_PATH,
+) -> Optional[FlatForestModels]:
+    """The exported models if they were built from the current pkl, else None."""
+    if not (forest_dir / "manifest.json").exists() or not models_path.exists():
+        return None
+    models = FlatForestModels.load(forest_dir)
+    if models.models_sha256 != file_sha256(models_path):
+        print(f"[gym_models] {forest_dir.name} is stale ({models_path.name} changed); "
+              f"run `python gym_models.py export`")
+        return None
+    return models
+
+
+# ---------------- verify ----------------
+
+def verify_gym_models(models_path: Path = GYM_MODEL_PATH, forest_dir: Path = GYM_FOREST_DIR) -> int:
+    """
+    Compare the flat predictor with the sklearn pipelines on every
+    combination of known categories plus unseen values. Returns mismatches.
+    """
+    import pandas as pd
+    from train2 import feature_domains, load_gym_models, predict_targets
+
+    _, _, bundle = load_gym_models(str(models_path))
+    flat = FlatForestModels.load(forest_dir)
+    cols = bundle["feature_cols"]
+
+    domains = feature_domains(bundle["model"] if bundle.get("multi_output") else bundle["exercise_model"])
+    rows = list(itertools.product(*([*domains[c], "<unseen>"] for c in cols)))
+
+    want = predict_targets(bundle, pd.DataFrame(rows, columns=cols))
+    got = flat.predict_targets(rows)
+
+    mismatches = 0
+    for w, g in zip(want, got):
+        bad = np.flatnonzero(np.asarray(w, dtype=object) != g)
+        mismatches += len(bad)
+        for i in bad[:10]:
+            print(f"  MISMATCH {rows[i]}: sklearn={w[i]!r} flat={g[i]!r}")
+    print(f"[gym_models] {len(rows)} feature combinations checked: {mismatches} mismatches")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / verify the flat NumPy GYM models")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("export", help=f"write {GYM_FOREST_DIR.name}/ from {GYM_MODEL_PATH.name}")
+    sub.add_parser("verify", help="compare the export with the sklearn pipelines")
+    args = parser.parse_args()
+
+    if not GYM_MODEL_PATH.exists():
+        raise FileNotFoundError(f"Gym models not found at {GYM_MODEL_PATH}. Run train2.py first.")
+
+    if args.command == "export":
+        out_dir = export_gym_models()
+        size = sum(p.stat().st_size for p in out_dir.iterdir())
+        print(f"[gym_models] Exported to {out_dir} ({size / 1e6:.2f} MB, "
+              f"pkl {GYM_MODEL_PATH.stat().st_size / 1e6:.2f} MB)")
+    elif verify_gym_models():
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+# inference.py
+"""
+Inference runtime used by app.py.
+
+InferenceBatcher is a small dynamic micro-batching scheduler: concurrent
+/analyze requests submit their preprocessed image tensors, a background
+thread collects them for up to `max_wait_ms` (or until `max_batch_size`
+images are queued), runs ONE forward pass and resolves a Future per image.
+
+ProcessInferencePool runs the model in N separate worker processes (each
+pinned to its own set of cores) so one uvicorn front end can use a whole
+many-core host. It plugs into InferenceBatcher as an asynchronous run_batch.
+"""
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+
+
+# run_batch gets a float tensor [N, 3, H, W] and returns probabilities [N, C],
+# either directly or as a Future (asynchronous backends such as the process pool).
+# The batch may live in a reused buffer: run_batch must not keep a reference
+# to it after it returns.
+RunBatchFn = Callable[[torch.Tensor], Union[np.ndarray, Future]]
+
+# collate turns the queued per-image tensors into one batch tensor
+CollateFn = Callable[[List[torch.Tensor]], torch.Tensor]
+
+
+class InferenceBatcher:
+    """
+    Collect image tensors from many in-flight requests and run them
+    through the model together.
+
+    Usage:
+        batcher = InferenceBatcher(run_batch, max_batch_size=16, max_wait_ms=5)
+        futures = batcher.submit([tensor_front, tensor_back, tensor_legs])
+        probs = [f.result() for f in futures]   # one np.ndarray [C] per image
+    """
+
+    def __init__(
+        self,
+        run_batch: RunBatchFn,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        max_in_flight: int = 1,
+        collate: CollateFn = torch.stack,
+        name: str = "physique-batcher",
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be >= 1, got {max_batch_size}")
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be >= 1, got {max_in_flight}")
+
+        self.run_batch = run_batch
+        self.collate = collate
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        # how many batches may be running at once (= number of worker
+        # processes for ProcessInferencePool, 1 for in-process inference)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._queue: "queue.Queue[Optional[Tuple[torch.Tensor, Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    # ---------- public API ----------
+
+    def submit(self, tensors: List[torch.Tensor]) -> List[Future]:
+        """Queue CHW image tensors; returns one Future per tensor."""
+        futures: List[Future] = []
+        for tensor in tensors:
+            fut: Future = Future()
+            self._queue.put((tensor, fut))
+            futures.append(fut)
+        return futures
+
+    def queue_depth(self) -> int:
+        """Approximate number of images waiting for a forward pass."""
+        return self._queue.qsize()
+
+    def close(self, timeout: Optional[float] = None):
+        """Stop the background thread after the queued work is done."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    # ---------- background thread ----------
+
+    def _collect(self, first: Tuple[torch.Tensor, Future]):
+        """Gather up to max_batch_size items, waiting at most max_wait."""
+        pending = [first]
+        stop = False
+        deadline = time.monotonic() + self.max_wait
+
+        while len(pending) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    # window is over, but still take what is already queued
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            pending.append(item)
+
+        return pending, stop
+
+    def _loop(self):
+        while True:
+            # wait for a free slot first: while all workers are busy,
+            # requests keep piling up and the next batch gets bigger
+            self._slots.acquire()
+            first = self._queue.get()
+            if first is None:
+                self._slots.release()
+                return
+
+            pending, stop = self._collect(first)
+            self._run(pending)
+            if stop:
+                return
+
+    def _run(self, pending: List[Tuple[torch.Tensor, Future]]):
+        # drop requests that were cancelled while waiting in the queue
+        pending = [(t, f) for t, f in pending if f.set_running_or_notify_cancel()]
+        if not pending:
+            self._slots.release()
+            return
+
+        try:
+            batch = self.collate([t for t, _ in pending])
+            result = self.run_batch(batch)
+        except Exception as e:
+            self._finish(pending, None, e)
+            return
+
+        if isinstance(result, Future):
+            result.add_done_callback(
+                lambda f: self._finish(pending, *_future_outcome(f))
+            )
+        else:
+            self._finish(pending, result, None)
+
+    def _finish(self, pending, probs, error: Optional[BaseException]):
+        self._slots.release()
+        if error is not None:
+            for _, fut in pending:
+                fut.set_exception(error)
+            return
+        for (_, fut), row in zip(pending, probs):
+            fut.set_result(row)
+
+
+def _future_outcome(fut: Future):
+    """(result, None) or (None, exception) for a finished Future."""
+    error = fut.exception()
+    if error is not None:
+        return None, error
+    return fut.result(), None
+
+
+# ---------------- model backends ----------------
+
+# "eager":       fp32 PhysiqueCNN (default)
+# "int8":        post-training static quantized model from quantize.py (CPU only)
+# "torchscript": frozen TorchScript graph from export_model.py
+# "onnx":        ONNX Runtime session on the export_model.py .onnx file
+BACKENDS = ("eager", "int8", "torchscript", "onnx")
+
+
+class OnnxRuntimeModel:
+    """
+    Wrap an ONNX Runtime session so it can be called like the torch model:
+    float tensor [N, 3, H, W] in, logits tensor [N, C] out.
+    """
+
+    def __init__(self, path: str, device: torch.device):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError(
+                "The onnx backend needs onnxruntime (pip install onnxruntime)"
+            ) from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = torch.get_num_threads()
+        providers = ["CPUExecutionProvider"]
+        if device.type == "cuda":
+            providers.insert(0, "CUDAExecutionProvider")
+
+        self.session = ort.InferenceSession(path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        x = np.ascontiguousarray(batch.detach().cpu().numpy(), dtype=np.float32)
+        (logits,) = self.session.run(None, {self.input_name: x})
+        return torch.from_numpy(logits)
+
+
+def resolve_backend(backend: str, weights_path: str) -> Tuple[str, Path]:
+    """
+    The (backend, file) to serve: pass both to load_backend_model.
+
+    Checking an export hashes the whole .pth, so resolve once and hand the
+    result to every loader (pool workers included) instead of re-checking.
+
+    An exported artifact whose source manifest doesn't match weights_path
+    (the .pth was retrained after the export, or the export predates source
+    manifests) is not served: the eager model is, with a warning saying
+    which script to re-run. A missing artifact is left to the loader, which
+    raises with the same hint.
+    """
+    from model import artifact_is_current, onnx_path, quantized_weights_path, torchscript_path
+
+    # backend -> (its artifact for this .pth, the script that builds it)
+    artifacts = {
+        "int8": (quantized_weights_path(weights_path), "quantize.py"),
+        "torchscript": (torchscript_path(weights_path), "export_model.py"),
+        "onnx": (onnx_path(weights_path), "export_model.py"),
+    }
+    if backend == "eager":
+        return backend, Path(weights_path)
+    if backend not in artifacts:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+
+    path, script = artifacts[backend]
+    if path.exists() and not artifact_is_current(path, weights_path):
+        print(f"[inference] {path.name} was not built from the current {Path(weights_path).name}; "
+              f"re-run {script}. Serving the eager model instead of {backend}.")
+        return "eager", Path(weights_path)
+    return backend, path
+
+
+def load_backend_model(
+    backend: str,
+    model_path: str,
+    num_classes: int,
+    device: torch.device,
+    mmap: bool = True,
+) -> Callable[[torch.Tensor], torch.Tensor]:
+    """
+    Load the model for a serving backend, ready for inference.
+    (backend, model_path) is what resolve_backend returned; it is not
+    re-checked here. Every backend is callable as
+    model(float batch) -> logits tensor.
+    """
+    from model import load_quantized_model, load_trained_model
+
+    path = Path(model_path)
+    if backend == "eager":
+        return load_trained_model(str(path), num_classes, device, mmap=mmap)
+    if backend == "int8":
+        if device.type != "cpu":
+            raise ValueError("The int8 backend only runs on CPU")
+        return load_quantized_model(str(path), num_classes)
+    if backend == "torchscript":
+        if not path.exists():
+            raise RuntimeError(f"TorchScript model not found at {path}. Run export_model.py first.")
+        model = torch.jit.load(str(path), map_location=device)
+        model.eval()
+        if device.type == "cpu":
+            # oneDNN weight prepacking + fusions; not serializable, so done here
+            model = torch.jit.optimize_for_inference(model)
+        return model
+    if backend == "onnx":
+        if not path.exists():
+            raise RuntimeError(f"ONNX model not found at {path}. Run export_model.py first.")
+        return OnnxRuntimeModel(str(path), device)
+    raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+
+
+# ---------------- multi-process worker pool ----------------
+
+# model of the current worker process (set by _init_worker)
+_WORKER_MODEL = None
+# channels_last pools send NHWC arrays (see ProcessInferencePool.forward)
+_WORKER_CHANNELS_LAST = False
+
+
+def _init_worker(
+    backend: str,
+    model_path: str,
+    num_classes: int,
+    threads_per_process: int,
+    core_sets: Sequence[Sequence[int]],
+    next_slot,
+    compile_mode: Optional[str] = None,
+    channels_last: bool = False,
+):
+    """ProcessPoolExecutor initializer: pin cores, size torch threads, load weights."""
+    global _WORKER_MODEL, _WORKER_CHANNELS_LAST
+
+    with next_slot.get_lock():
+        slot = next_slot.value
+        next_slot.value += 1
+
+    if core_sets and hasattr(os, "sched_setaffinity"):
+        cores = core_sets[slot % len(core_sets)]
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError as e:
+            print(f"[inference] worker {slot}: could not pin cores {list(cores)}: {e}")
+
+    torch.set_num_threads(threads_per_process)
+    torch.set_num_interop_threads(1)
+
+    # mmap=True: an eager state dict is backed by the page cache of the .pth
+    # file, so workers share one physical copy of the weights -- but only for
+    # the plain eager model. channels_last (.to() copies every conv weight),
+    # compile_mode, and the int8 / torchscript / onnx loaders (no mmap) give
+    # each worker its own private copy.
+    _WORKER_MODEL = load_backend_model(
+        backend, model_path, num_classes, torch.device("cpu"), mmap=True
+    )
+    _WORKER_CHANNELS_LAST = channels_last
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    if channels_last and isinstance(_WORKER_MODEL, torch.nn.Module) and backend != "torchscript":
+        _WORKER_MODEL = _WORKER_MODEL.to(memory_format=memory_format)
+    if compile_mode is not None and backend == "eager":
+        from model import compile_model
+        from preprocess import IMG_SIZE
+
+        # 1 is specialized; 2 then 3 makes the batch dimension dynamic
+        examples = [
+            torch.zeros((n, 3, IMG_SIZE, IMG_SIZE)).contiguous(memory_format=memory_format)
+            for n in (1, 2, 3)
+        ]
+        _WORKER_MODEL = compile_model(_WORKER_MODEL, examples, mode=compile_mode)
+    print(f"[inference] worker {slot} (pid={os.getpid()}) ready, "
+          f"threads={threads_per_process}, channels_last={channels_last}")
+
+
+def _worker_forward(batch: np.ndarray) -> np.ndarray:
+    x = torch.from_numpy(batch)
+    if _WORKER_CHANNELS_LAST:
+        x = x.permute(0, 3, 1, 2)  # NHWC array -> channels_last NCHW view, no copy
+    with torch.no_grad():
+        logits = _WORKER_MODEL(x)
+        return torch.softmax(logits, dim=1).numpy()
+
+
+def _split_cores(processes: int, threads_per_process: int) -> List[List[int]]:
+    """Disjoint core sets, one per worker (empty if the host is too small)."""
+    if not hasattr(os, "sched_getaffinity"):
+        return []
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < processes * threads_per_process:
+        return []
+    return [
+        cores[i * threads_per_process:(i + 1) * threads_per_process]
+        for i in range(processes)
+    ]
+
+
+class ProcessInferencePool:
+    """
+    N inference processes × T torch threads each.
+
+    Every worker loads `model_path` with `backend` (both as returned by
+    resolve_backend, so workers don't re-hash the weights) and is pinned to its
+    own disjoint core set, so workers don't fight over the same cores.
+    With compile_mode, eager workers torch.compile their model on start-up.
+    With channels_last, worker models are NHWC and batches cross the process
+    boundary as NHWC arrays, so the layout survives pickling.
+    `forward` is asynchronous and is meant to be used as the run_batch of
+    an InferenceBatcher created with max_in_flight=processes.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        num_classes: int,
+        processes: int,
+        threads_per_process: Optional[int] = None,
+        pin_cores: bool = True,
+        backend: str = "eager",
+        compile_mode: Optional[str] = None,
+        channels_last: bool = False,
+    ):
+        if processes < 1:
+            raise ValueError(f"processes must be >= 1, got {processes}")
+        if threads_per_process is None:
+            threads_per_process = max(1, (os.cpu_count() or 1) // processes)
+
+        self.processes = processes
+        self.threads_per_process = threads_per_process
+        self.channels_last = channels_last
+        core_sets = _split_cores(processes, threads_per_process) if pin_cores else []
+
+        # spawn, not fork: forking a process that already started torch's
+        # thread pools can deadlock the children
+        ctx = mp.get_context("spawn")
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(
+                backend,
+                model_path,
+                num_classes,
+                threads_per_process,
+                core_sets,
+                ctx.Value("i", 0),
+                compile_mode,
+                channels_last,
+            ),
+        )
+
+    def forward(self, batch: torch.Tensor) -> Future:
+        """Send a [N, 3, H, W] batch to a free worker; resolves to probs [N, C]."""
+        # copy now: the executor pickles the arguments later, on its own
+        # thread, and `batch` may be a buffer the batcher reuses. numpy
+        # pickles C order, so a channels_last batch goes over as its
+        # (contiguous) NHWC view instead of being transposed back to NCHW.
+        if self.channels_last:
+            batch = batch.permute(0, 2, 3, 1)
+        return self._executor.submit(_worker_forward, batch.numpy().copy())
+
+    def warm(self):
+        """Start all workers now (and load their weights) instead of on first use."""
+        from preprocess import IMG_SIZE
+
+        shape = (1, IMG_SIZE, IMG_SIZE, 3) if self.channels_last else (1, 3, IMG_SIZE, IMG_SIZE)
+        dummy = np.zeros(shape, dtype=np.float32)
+        futures = [self._executor.submit(_worker_forward, dummy) for _ in range(self.processes)]
+        for f in futures:
+            f.result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,174 @@
+# metrics.py
+"""
+Low-overhead in-process metrics for the serving hot path, exported in the
+Prometheus text format by app.py's /metrics (no prometheus_client needed).
+
+  Histogram      fixed buckets; observe() is one bisect + two adds under a lock
+  Counter        monotonically increasing value
+  CallbackGauge  value read from a function at scrape time (queue depth,
+                 cache counters...), so the hot path pays nothing for it
+
+All metrics register themselves in REGISTRY. Each uvicorn worker process
+has its own registry; Prometheus scrapes / aggregates them per worker.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+
+# seconds; covers sub-ms rule lookups up to multi-second cold forwards
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: Registry = REGISTRY,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (+inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        registry.register(self)
+
+    def observe(self, value: float, *labelvalues: str):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        """`with HISTOGRAM.time("decode"): ...` observes the elapsed seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = {k: (list(v[0]), v[1]) for k, v in self._series.items()}
+        lines = []
+        for labelvalues, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _fmt(bound)
+                bucket_labels = _labels(self.labelnames, labelvalues, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {total!r}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {cumulative}")
+        return lines
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+        registry.register(self)
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in values]
+
+
+class CallbackGauge:
+    """
+    Value(s) computed at scrape time. `fn` returns a number, or a dict
+    {label value: number} when `labelname` is given.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        fn: Callable[[], object],
+        labelname: str = "",
+        type: str = "gauge",
+        registry: Registry = REGISTRY,
+    ):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelname = labelname
+        self.type = type
+        registry.register(self)
+
+    def samples(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return []  # source not loaded yet (lazy start-up)
+        if value is None:
+            return []
+        if self.labelname:
+            return [
+                f"{self.name}{_labels((self.labelname,), (k,))} {_fmt(v)}"
+                for k, v in sorted(value.items())
+            ]
+        return [f"{self.name} {_fmt(value)}"]
@@ -1,24 +1,39 @@
 # model.py
-from typing import Optional
+import json
+from pathlib import Path
+import time
+from typing import Optional, Sequence
 import torch
 from torch import nn
 from torchvision import models
 
+from utils import file_sha256, write_manifest
+
 
 class PhysiqueCNN(nn.Module):
     """
     Simple ResNet18-based classifier.
     Final layer size is num_classes (10 with your new dataset).
+
+    pretrained=True starts from ImageNet weights (training). Inference
+    passes pretrained=False: the trained weights overwrite everything
+    anyway, so there is no need to load (or download) the ImageNet ones.
     """
 
-    def __init__(self, num_classes: int):
+    def __init__(self, num_classes: int, pretrained: bool = True):
         super().__init__()
 
         # Handle different torchvision versions
-        try:
-            backbone = models.resnet18(weights=models.ResNet18_Weights.DEFAULT)
-        except AttributeError:
-            backbone = models.resnet18(pretrained=True)
+        if pretrained:
+            try:
+                backbone = models.resnet18(weights=models.ResNet18_Weights.DEFAULT)
+            except AttributeError:
+                backbone = models.resnet18(pretrained=True)
+        else:
+            try:
+                backbone = models.resnet18(weights=None)
+            except TypeError:
+                backbone = models.resnet18(pretrained=False)
 
         in_features = backbone.fc.in_features
         backbone.fc = nn.Linear(in_features, num_classes)
@@ -28,15 +43,231 @@ class PhysiqueCNN(nn.Module):
         return self.backbone(x)
 
 
+def load_state_dict_file(weights_path: str, mmap: bool = True) -> dict:
+    """
+    Load a state dict saved with torch.save on CPU.
+
+    mmap=True memory-maps the file instead of reading it into RAM: tensors
+    are paged in from the page cache on first use, and several processes
+    loading the same file share one physical copy.
+    """
+    if mmap:
+        try:
+            return torch.load(weights_path, map_location="cpu", mmap=True, weights_only=True)
+        except (TypeError, RuntimeError):
+            # older torch without mmap= / weights_only=, or a legacy
+            # (non-zipfile) checkpoint that can't be mapped
+            pass
+    return torch.load(weights_path, map_location="cpu")
+
+
 def load_trained_model(
     weights_path: str,
     num_classes: int,
     device: torch.device,
+    mmap: bool = True,
 ) -> PhysiqueCNN:
-    """Load trained weights for inference."""
-    model = PhysiqueCNN(num_classes=num_classes)
-    state = torch.load(weights_path, map_location=device)
-    model.load_state_dict(state)
+    """
+    Load trained weights for inference.
+
+    The model skeleton is built on the meta device (no memory allocated, no
+    random init, no ImageNet weights) and the loaded tensors are assigned as
+    its parameters directly. With mmap=True (see load_state_dict_file) the
+    only thing startup reads is physique_cnn.pth, on demand.
+    """
+    state = load_state_dict_file(weights_path, mmap=mmap)
+
+    try:
+        with torch.device("meta"):
+            model = PhysiqueCNN(num_classes=num_classes, pretrained=False)
+        model.load_state_dict(state, assign=True)
+    except (AttributeError, TypeError):
+        # torch < 2.1: no device context manager / load_state_dict(assign=)
+        model = PhysiqueCNN(num_classes=num_classes, pretrained=False)
+        model.load_state_dict(state)
+
     model.to(device)
     model.eval()
     return model
+
+
+# ---------------- INT8 (post-training static quantization) ----------------
+
+def quantized_weights_path(weights_path: str) -> Path:
+    """weights/physique_cnn.pth -> weights/physique_cnn_int8.pth"""
+    path = Path(weights_path)
+    return path.with_name(f"{path.stem}_int8{path.suffix}")
+
+
+def torchscript_path(weights_path: str) -> Path:
+    """weights/physique_cnn.pth -> weights/physique_cnn.torchscript.pt (export_model.py)"""
+    path = Path(weights_path)
+    return path.with_name(f"{path.stem}.torchscript.pt")
+
+
+def onnx_path(weights_path: str) -> Path:
+    """weights/physique_cnn.pth -> weights/physique_cnn.onnx (export_model.py)"""
+    path = Path(weights_path)
+    return path.with_name(f"{path.stem}.onnx")
+
+
+def _quant_engine() -> str:
+    """Best available quantized kernel backend for this CPU."""
+    engines = torch.backends.quantized.supported_engines
+    for name in ("x86", "fbgemm", "qnnpack"):
+        if name in engines:
+            return name
+    raise RuntimeError(f"No quantized engine available (supported: {engines})")
+
+
+class QuantizablePhysiqueCNN(nn.Module):
+    """
+    Same network as PhysiqueCNN, built from torchvision's quantizable
+    ResNet18 (QuantStub/DeQuantStub + quantization-friendly residual adds).
+    Parameter names match PhysiqueCNN, so physique_cnn.pth loads as-is.
+    """
+
+    def __init__(self, num_classes: int):
+        super().__init__()
+        from torchvision.models import quantization as qmodels
+
+        backbone = qmodels.resnet18(weights=None, quantize=False)
+        backbone.fc = nn.Linear(backbone.fc.in_features, num_classes)
+        self.backbone = backbone
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.backbone(x)
+
+    def fuse_model(self):
+        """Fuse conv+bn(+relu) blocks in place (model must be in eval mode)."""
+        self.backbone.fuse_model()
+
+
+def prepare_for_int8(fp32_state: Optional[dict], num_classes: int) -> QuantizablePhysiqueCNN:
+    """
+    Load fp32 weights into a quantizable model, fuse conv-bn-relu and insert
+    observers. Run calibration batches through the result, then call
+    `torch.ao.quantization.convert(model, inplace=True)`.
+    """
+    from torch.ao import quantization as tq
+
+    engine = _quant_engine()
+    torch.backends.quantized.engine = engine
+
+    model = QuantizablePhysiqueCNN(num_classes)
+    if fp32_state is not None:
+        model.load_state_dict(fp32_state)
+    model.eval()
+    model.fuse_model()
+    model.qconfig = tq.get_default_qconfig(engine)
+    tq.prepare(model, inplace=True)
+    return model
+
+
+def load_quantized_model(weights_path: str, num_classes: int) -> QuantizablePhysiqueCNN:
+    """
+    Load an INT8 model saved by quantize.py (CPU only).
+
+    The quantized state dict can only be loaded into a model that went
+    through the same fuse -> prepare -> convert steps, so we rebuild that
+    skeleton first (no calibration needed, the scales come from the file).
+    """
+    from torch.ao import quantization as tq
+
+    path = Path(weights_path)
+    if not path.exists():
+        raise FileNotFoundError(
+            f"INT8 weights not found at {path}. Run quantize.py first."
+        )
+
+    model = prepare_for_int8(None, num_classes)
+    tq.convert(model, inplace=True)
+    state = torch.load(path, map_location="cpu")
+    model.load_state_dict(state)
+    model.eval()
+    return model
+
+
+# ---------------- exported artifacts ----------------
+#
+# quantize.py / export_model.py write "<artifact>.source.json" next to every
+# file they derive from physique_cnn.pth, recording the sha256 of the .pth it
+# was built from. inference.resolve_backend won't serve an artifact whose
+# source no longer matches (retrained weights, export not re-run).
+
+def source_manifest_path(artifact_path) -> Path:
+    """weights/physique_cnn_int8.pth -> weights/physique_cnn_int8.pth.source.json"""
+    path = Path(artifact_path)
+    return path.with_name(f"{path.name}.source.json")
+
+
+def write_source_manifest(artifact_path, weights_path, source_sha256: Optional[str] = None):
+    """Record that artifact_path was built from weights_path (pass the sha256 if already known)."""
+    write_manifest(source_manifest_path(artifact_path), {
+        "source": Path(weights_path).name,
+        "source_sha256": source_sha256 or file_sha256(Path(weights_path)),
+    })
+
+
+def artifact_is_current(artifact_path, weights_path) -> bool:
+    """True if artifact_path was built from weights_path as it is on disk now."""
+    manifest_path = source_manifest_path(artifact_path)
+    if not manifest_path.exists():
+        return False  # exported before source manifests existed: unknown origin
+    with manifest_path.open("r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return manifest.get("source_sha256") == file_sha256(Path(weights_path))
+
+
+# ---------------- torch.compile ----------------
+
+COMPILE_MODES = ("default", "reduce-overhead", "max-autotune", "max-autotune-no-cudagraphs")
+
+
+def compile_model(
+    model: nn.Module,
+    examples: Sequence[torch.Tensor],
+    mode: str = "default",
+    train: bool = False,
+) -> nn.Module:
+    """
+    torch.compile `model` and run every batch in `examples` through it, so
+    compilation happens now instead of on the first real batch. A batch of
+    1 gets its own specialized graph; two more sizes > 1 make the batch
+    dimension dynamic, after which no size > 1 recompiles. train=True
+    compiles forward + backward; the parameters' grads and the BatchNorm
+    running stats are restored after.
+
+    Returns `model` unchanged if torch.compile is unavailable (torch < 2.0,
+    TorchScript modules) or fails on this platform, e.g. no C++ compiler
+    for the inductor CPU backend.
+    """
+    if mode not in COMPILE_MODES:
+        raise ValueError(f"Unknown torch.compile mode {mode!r}, expected one of {COMPILE_MODES}")
+    if not hasattr(torch, "compile") or isinstance(model, torch.jit.ScriptModule):
+        print("[model] torch.compile not available for this model, running uncompiled")
+        return model
+
+    start = time.perf_counter()
+    buffers = {name: b.detach().clone() for name, b in model.named_buffers()}
+    try:
+        compiled = torch.compile(model, mode=mode)
+        for batch in examples:
+            if train:
+                compiled(batch).float().sum().backward()
+            else:
+                with torch.no_grad():
+                    compiled(batch)
+    except Exception as e:
+        print(f"[model] torch.compile failed ({type(e).__name__}: {e}), running uncompiled")
+        return model
+    finally:
+        if train:
+            for p in model.parameters():
+                p.grad = None
+            with torch.no_grad():
+                for name, b in model.named_buffers():
+                    b.copy_(buffers[name])
+
+    print(f"[model] torch.compile (mode={mode}) took {time.perf_counter() - start:.1f}s")
+    return compiled
@@ -0,0 +1,649 @@
+# plan_rules.py
+"""
+Fast plan-rule selection for app.py.
+
+app.py picks one row of data/plan_rules.csv per weak muscle with four
+fallback tiers (see select_rule_linear, the reference implementation):
+
+  FULL         muscle, strength, goal, experience, equipment, time slot
+               and overall score inside [overall_min_score, overall_max_score]
+  NO-TIME      same without the time slot
+  LOOSE        muscle, goal, experience, equipment
+  SAME-MUSCLE  first rule for the muscle
+  GLOBAL       first rule of the file
+
+Within a tier the FIRST matching row in CSV order wins. RuleIndex builds
+hash maps for every tier once at startup, plus an interval structure for
+the score range, so a lookup is a couple of dict gets and one bisect
+instead of scanning all rows up to four times.
+
+The inputs are tiny discrete domains, and app.py rounds the overall score
+to one decimal, so RuleTable goes one step further: a build step enumerates
+every (muscle, strength, goal, experience, equipment, time slot, score)
+combination once and stores the chosen row in an array. A lookup is then a
+single array index.
+
+PlanRules keeps the rows themselves columnar: categorical and text columns
+as integer codes into one deduplicated string pool, numbers as NumPy
+arrays. `compile` writes those arrays as .npy files that every uvicorn
+worker memory-maps, so the pages are shared instead of each process
+holding its own 11k dicts of repeated description strings.
+
+Usage:
+    python plan_rules.py compile          # writes data/plan_rules_columns/
+    python plan_rules.py build            # writes data/plan_rule_table.npz
+    python plan_rules.py verify [--full]  # checks the table against the reference
+"""
+import argparse
+import csv
+import json
+import math
+import sys
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils import file_sha256, write_manifest
+
+
+BACKEND_ROOT = Path(__file__).resolve().parent
+DATA_DIR = BACKEND_ROOT / "data"
+PLAN_RULES_PATH = DATA_DIR / "plan_rules.csv"
+RULE_TABLE_PATH = DATA_DIR / "plan_rule_table.npz"
+RULE_COLUMNS_DIR = DATA_DIR / "plan_rules_columns"
+
+
+TIER_FULL = "FULL"
+TIER_NO_TIME = "NO-TIME"
+TIER_LOOSE = "LOOSE"
+TIER_SAME_MUSCLE = "SAME-MUSCLE"
+TIER_GLOBAL = "GLOBAL"
+TIERS = (TIER_FULL, TIER_NO_TIME, TIER_LOOSE, TIER_SAME_MUSCLE, TIER_GLOBAL)
+
+# the categorical inputs of a lookup, in RuleTable axis order
+KEY_FIELDS = ("muscle_group", "strength_level", "goal", "experience", "equipment", "time_slot")
+
+# overall scores are rounded to one decimal in app.py and live in 1.0–10.0
+SCORE_MIN_TENTHS = 10
+SCORE_MAX_TENTHS = 100
+
+
+def load_plan_rules_csv(path: Path = PLAN_RULES_PATH) -> List[Dict[str, Any]]:
+    """Read plan_rules.csv into a list of dicts with typed id / score columns."""
+    rules: List[Dict[str, Any]] = []
+    with path.open("r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            row["id"] = int(row["id"])
+            row["overall_min_score"] = float(row["overall_min_score"])
+            row["overall_max_score"] = float(row["overall_max_score"])
+            rules.append(row)
+    return rules
+
+
+class ScoreIntervals:
+    """
+    Answer "first row (in CSV order) whose [min, max] contains score" for
+    a fixed set of rows.
+
+    The sorted distinct interval endpoints cut the score axis into points
+    and open gaps; every score inside one of those pieces is contained in
+    exactly the same rows, so the answer is precomputed per piece and a
+    lookup is one bisect.
+    """
+
+    def __init__(self, rows: Sequence[Tuple[float, float, int]]):
+        # rows: (min_score, max_score, row_position), in CSV order
+        points = sorted({r[0] for r in rows} | {r[1] for r in rows})
+        self._points = points
+        self._at_point = [self._first(rows, p) for p in points]
+        self._in_gap = [
+            self._first(rows, (lo + hi) / 2.0) for lo, hi in zip(points, points[1:])
+        ]
+
+    @staticmethod
+    def _first(rows, score: float) -> Optional[int]:
+        for lo, hi, pos in rows:
+            if lo <= score <= hi:
+                return pos
+        return None
+
+    def lookup(self, score: float) -> Optional[int]:
+        points = self._points
+        i = bisect_left(points, score)
+        if i < len(points) and points[i] == score:
+            return self._at_point[i]
+        if i == 0 or i == len(points):
+            return None  # below the lowest min / above the highest max (or NaN)
+        return self._in_gap[i - 1]
+
+
+class RuleIndex:
+    """Precomputed per-tier indexes over the plan rules (row positions, not copies)."""
+
+    def __init__(self, rules: Sequence[Mapping[str, Any]]):
+        if len(rules) == 0:
+            raise ValueError("RuleIndex needs at least one plan rule")
+
+        full: Dict[tuple, List[Tuple[float, float, int]]] = {}
+        no_time: Dict[tuple, List[Tuple[float, float, int]]] = {}
+        self._loose: Dict[tuple, int] = {}
+        self._same_muscle: Dict[str, int] = {}
+
+        for pos, row in enumerate(rules):
+            muscle = row["muscle_group"]
+            interval = (row["overall_min_score"], row["overall_max_score"], pos)
+            base = (muscle, row["strength_level"], row["goal"], row["experience"], row["equipment"])
+
+            full.setdefault(base + (row["time_slot"],), []).append(interval)
+            no_time.setdefault(base, []).append(interval)
+            self._loose.setdefault((muscle, row["goal"], row["experience"], row["equipment"]), pos)
+            self._same_muscle.setdefault(muscle, pos)
+
+        self._full = {k: ScoreIntervals(v) for k, v in full.items()}
+        self._no_time = {k: ScoreIntervals(v) for k, v in no_time.items()}
+
+    def select(
+        self,
+        muscle: str,
+        strength_level: str,
+        goal: str,
+        experience: str,
+        equipment: str,
+        time_slot: str,
+        overall_score: float,
+    ) -> Tuple[int, str]:
+        """Return (row position, tier) of the rule select_rule_linear would pick."""
+        base = (muscle, strength_level, goal, experience, equipment)
+
+        intervals = self._full.get(base + (time_slot,))
+        if intervals is not None:
+            pos = intervals.lookup(overall_score)
+            if pos is not None:
+                return pos, TIER_FULL
+
+        intervals = self._no_time.get(base)
+        if intervals is not None:
+            pos = intervals.lookup(overall_score)
+            if pos is not None:
+                return pos, TIER_NO_TIME
+
+        pos = self._loose.get((muscle, goal, experience, equipment))
+        if pos is not None:
+            return pos, TIER_LOOSE
+
+        pos = self._same_muscle.get(muscle)
+        if pos is not None:
+            return pos, TIER_SAME_MUSCLE
+
+        return 0, TIER_GLOBAL
+
+
+def select_rule_linear(
+    rules: Sequence[Mapping[str, Any]],
+    muscle: str,
+    strength_level: str,
+    goal: str,
+    experience: str,
+    equipment: str,
+    time_slot: str,
+    overall_score: float,
+) -> Tuple[int, str]:
+    """
+    Reference implementation: the original linear scans over all rules.
+    Slow; kept to verify the faster structures against.
+    """
+    for pos, row in enumerate(rules):
+        if (
+            row["muscle_group"] == muscle
+            and row["strength_level"] == strength_level
+            and row["goal"] == goal
+            and row["experience"] == experience
+            and row["equipment"] == equipment
+            and row["time_slot"] == time_slot
+            and row["overall_min_score"] <= overall_score <= row["overall_max_score"]
+        ):
+            return pos, TIER_FULL
+
+    for pos, row in enumerate(rules):
+        if (
+            row["muscle_group"] == muscle
+            and row["strength_level"] == strength_level
+            and row["goal"] == goal
+            and row["experience"] == experience
+            and row["equipment"] == equipment
+            and row["overall_min_score"] <= overall_score <= row["overall_max_score"]
+        ):
+            return pos, TIER_NO_TIME
+
+    for pos, row in enumerate(rules):
+        if (
+            row["muscle_group"] == muscle
+            and row["goal"] == goal
+            and row["experience"] == experience
+            and row["equipment"] == equipment
+        ):
+            return pos, TIER_LOOSE
+
+    for pos, row in enumerate(rules):
+        if row["muscle_group"] == muscle:
+            return pos, TIER_SAME_MUSCLE
+
+    return 0, TIER_GLOBAL
+
+
+# ---------------- columnar rule storage ----------------
+
+# plan_rules.csv columns that are not strings
+INT_COLUMNS = ("id",)
+FLOAT_COLUMNS = ("overall_min_score", "overall_max_score")
+
+
+class PlanRule:
+    """One row of a PlanRules store; reads like the old dict (rule["workout_title"])."""
+
+    __slots__ = ("_rules", "_pos")
+
+    def __init__(self, rules: "PlanRules", pos: int):
+        self._rules = rules
+        self._pos = pos
+
+    def __getitem__(self, column: str):
+        return self._rules.value(self._pos, column)
+
+    def get(self, column: str, default=None):
+        if column not in self._rules.columns:
+            return default
+        return self._rules.value(self._pos, column)
+
+    def keys(self):
+        return self._rules.column_names
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {c: self[c] for c in self._rules.column_names}
+
+    def __repr__(self):
+        return f"PlanRule({self.to_dict()!r})"
+
+
+class PlanRules(Sequence):
+    """
+    Plan rules stored column-wise.
+
+      - id                        int32 array
+      - overall_min/max_score     float64 arrays
+      - every other column        integer codes into one shared string pool
+
+    The pool is a single UTF-8 blob plus offsets; strings are decoded on
+    first use and interned, so each distinct title/description exists once
+    per process no matter how many rows repeat it.
+    """
+
+    def __init__(
+        self,
+        column_names: Sequence[str],
+        columns: Dict[str, np.ndarray],
+        string_blob: np.ndarray,
+        string_offsets: np.ndarray,
+        csv_sha256: str = "",
+    ):
+        self.column_names = list(column_names)
+        self.columns = columns
+        self.csv_sha256 = csv_sha256
+        self._blob = string_blob
+        self._offsets = string_offsets
+        self._strings: List[Optional[str]] = [None] * (len(string_offsets) - 1)
+        self._len = len(columns[self.column_names[0]])
+
+    # ---------- build ----------
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Mapping[str, Any]], csv_sha256: str = "") -> "PlanRules":
+        if len(rows) == 0:
+            raise ValueError("PlanRules needs at least one plan rule")
+        column_names = list(rows[0].keys())
+
+        pool: Dict[str, int] = {}
+        columns: Dict[str, np.ndarray] = {}
+        for name in column_names:
+            values = [row[name] for row in rows]
+            if name in INT_COLUMNS:
+                columns[name] = np.asarray(values, dtype=np.int32)
+            elif name in FLOAT_COLUMNS:
+                columns[name] = np.asarray(values, dtype=np.float64)
+            else:
+                columns[name] = np.asarray(
+                    [pool.setdefault(v, len(pool)) for v in values], dtype=np.int64
+                )
+
+        code_dtype = np.uint16 if len(pool) <= np.iinfo(np.uint16).max else np.int32
+        for name in column_names:
+            if name not in INT_COLUMNS and name not in FLOAT_COLUMNS:
+                columns[name] = columns[name].astype(code_dtype)
+
+        encoded = [s.encode("utf-8") for s in pool]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(column_names, columns, blob, offsets, csv_sha256)
+
+    # ---------- access ----------
+
+    def string(self, code: int) -> str:
+        s = self._strings[code]
+        if s is None:
+            start, end = int(self._offsets[code]), int(self._offsets[code + 1])
+            s = sys.intern(self._blob[start:end].tobytes().decode("utf-8"))
+            self._strings[code] = s
+        return s
+
+    def value(self, pos: int, column: str):
+        v = self.columns[column][pos]
+        if column in INT_COLUMNS:
+            return int(v)
+        if column in FLOAT_COLUMNS:
+            return float(v)
+        return self.string(int(v))
+
+    @property
+    def num_strings(self) -> int:
+        return len(self._strings)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, pos: int) -> PlanRule:
+        if pos < 0:
+            pos += self._len
+        if not 0 <= pos < self._len:
+            raise IndexError(pos)
+        return PlanRule(self, pos)
+
+    def __iter__(self) -> Iterator[PlanRule]:
+        for pos in range(self._len):
+            yield PlanRule(self, pos)
+
+    # ---------- save / load ----------
+
+    def save(self, directory: Path = RULE_COLUMNS_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, array in self.columns.items():
+            np.save(directory / f"{name}.npy", np.ascontiguousarray(array))
+        np.save(directory / "strings_blob.npy", np.ascontiguousarray(self._blob))
+        np.save(directory / "strings_offsets.npy", self._offsets)
+        write_manifest(directory / "manifest.json", {
+            "columns": self.column_names,
+            "rows": self._len,
+            "strings": self.num_strings,
+            "csv_sha256": self.csv_sha256,
+        })
+
+    @classmethod
+    def load(cls, directory: Path = RULE_COLUMNS_DIR, mmap: bool = True) -> "PlanRules":
+        mode = "r" if mmap else None
+        with (directory / "manifest.json").open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        columns = {
+            name: np.load(directory / f"{name}.npy", mmap_mode=mode, allow_pickle=False)
+            for name in manifest["columns"]
+        }
+        return cls(
+            manifest["columns"],
+            columns,
+            np.load(directory / "strings_blob.npy", mmap_mode=mode, allow_pickle=False),
+            np.load(directory / "strings_offsets.npy", allow_pickle=False),
+            manifest["csv_sha256"],
+        )
+
+
+def load_plan_rules(csv_path: Path = PLAN_RULES_PATH, columns_dir: Path = RULE_COLUMNS_DIR) -> PlanRules:
+    """
+    The memory-mapped compiled columns if they were built from this exact
+    CSV, otherwise the CSV parsed into an in-memory PlanRules.
+    """
+    csv_sha256 = file_sha256(csv_path)
+    if (columns_dir / "manifest.json").exists():
+        rules = PlanRules.load(columns_dir)
+        if rules.csv_sha256 == csv_sha256:
+            return rules
+        print(f"[plan_rules] {columns_dir.name} is stale (plan_rules.csv changed); "
+              f"run `python plan_rules.py compile`")
+    return PlanRules.from_rows(load_plan_rules_csv(csv_path), csv_sha256)
+
+
+# ---------------- precomputed table over the whole input domain ----------------
+
+class RuleTable:
+    """
+    Chosen rule (row position + tier) for every combination of the
+    categorical inputs and every overall score 1.0, 1.1, ..., 10.0.
+
+    Inputs outside that domain (unknown goal strings, unrounded scores...)
+    return None from `lookup`; the caller falls back to RuleIndex.
+    """
+
+    def __init__(
+        self,
+        domains: Dict[str, List[str]],
+        positions: np.ndarray,
+        tiers: np.ndarray,
+        csv_sha256: str = "",
+    ):
+        self.domains = domains
+        self.positions = positions
+        self.tiers = tiers
+        self.csv_sha256 = csv_sha256
+        self._codes = [
+            {value: code for code, value in enumerate(domains[field])}
+            for field in KEY_FIELDS
+        ]
+
+    # ---------- build / verify ----------
+
+    @classmethod
+    def build(cls, rules: Sequence[Mapping[str, Any]], csv_sha256: str = "") -> "RuleTable":
+        """Enumerate the domain once through RuleIndex."""
+        index = RuleIndex(rules)
+        domains: Dict[str, List[str]] = {}
+        for field in KEY_FIELDS:
+            # first-appearance order, like the CSV
+            domains[field] = list(dict.fromkeys(row[field] for row in rules))
+
+        n_scores = SCORE_MAX_TENTHS - SCORE_MIN_TENTHS + 1
+        shape = tuple(len(domains[f]) for f in KEY_FIELDS) + (n_scores,)
+        positions = np.empty(shape, dtype=np.int32)
+        tiers = np.empty(shape, dtype=np.uint8)
+
+        for combo in np.ndindex(*shape[:-1]):
+            values = [domains[f][c] for f, c in zip(KEY_FIELDS, combo)]
+            for s in range(n_scores):
+                pos, tier = index.select(*values, (SCORE_MIN_TENTHS + s) / 10)
+                positions[combo + (s,)] = pos
+                tiers[combo + (s,)] = TIERS.index(tier)
+
+        return cls(domains, positions, tiers, csv_sha256)
+
+    def iter_cells(self):
+        """Yield (lookup args, position, tier) for every cell of the table."""
+        for cell in np.ndindex(*self.positions.shape):
+            values = [self.domains[f][c] for f, c in zip(KEY_FIELDS, cell[:-1])]
+            score = (SCORE_MIN_TENTHS + cell[-1]) / 10
+            yield tuple(values) + (score,), int(self.positions[cell]), TIERS[self.tiers[cell]]
+
+    # ---------- lookup ----------
+
+    def lookup(
+        self,
+        muscle: str,
+        strength_level: str,
+        goal: str,
+        experience: str,
+        equipment: str,
+        time_slot: str,
+        overall_score: float,
+    ) -> Optional[Tuple[int, str]]:
+        """(row position, tier), or None if the inputs are outside the table."""
+        if not math.isfinite(overall_score):
+            return None
+        tenths = round(overall_score * 10)
+        # only scores that are exactly a table grid value (as produced by round(x, 1))
+        if not (SCORE_MIN_TENTHS <= tenths <= SCORE_MAX_TENTHS) or tenths / 10 != overall_score:
+            return None
+
+        cell = []
+        for codes, value in zip(
+            self._codes,
+            (muscle, strength_level, goal, experience, equipment, time_slot),
+        ):
+            code = codes.get(value)
+            if code is None:
+                return None
+            cell.append(code)
+        cell.append(tenths - SCORE_MIN_TENTHS)
+
+        cell = tuple(cell)
+        return int(self.positions[cell]), TIERS[self.tiers[cell]]
+
+    # ---------- save / load ----------
+
+    def save(self, path: Path = RULE_TABLE_PATH):
+        np.savez(
+            path,
+            positions=self.positions,
+            tiers=self.tiers,
+            domains=np.array(json.dumps(self.domains)),
+            csv_sha256=np.array(self.csv_sha256),
+        )
+
+    @classmethod
+    def load(cls, path: Path = RULE_TABLE_PATH) -> "RuleTable":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                json.loads(str(data["domains"])),
+                data["positions"],
+                data["tiers"],
+                str(data["csv_sha256"]),
+            )
+
+
+def load_rule_table(csv_path: Path = PLAN_RULES_PATH, table_path: Path = RULE_TABLE_PATH) -> Optional[RuleTable]:
+    """The saved RuleTable if it exists and was built from this exact CSV, else None."""
+    if not table_path.exists():
+        return None
+    table = RuleTable.load(table_path)
+    if table.csv_sha256 != file_sha256(csv_path):
+        print(f"[plan_rules] {table_path.name} is stale (plan_rules.csv changed); "
+              f"run `python plan_rules.py build`")
+        return None
+    return table
+
+
+def _check_cells(args):
+    """Worker for verify --full: compare a chunk of cells with select_rule_linear."""
+    rules, cells = args
+    return [
+        (cell, got, select_rule_linear(rules, *cell))
+        for cell, got in cells
+        if select_rule_linear(rules, *cell) != got
+    ]
+
+
+def verify_rule_table(rules, table: RuleTable, full: bool = False, sample: int = 2000, seed: int = 0) -> int:
+    """
+    Compare every table cell with RuleIndex, and cells with the original
+    linear tiered matching (all of them with full=True, else a random sample).
+    Also checks that non-finite and off-grid scores miss the table.
+    Returns the number of mismatches.
+    """
+    index = RuleIndex(rules)
+    cells = [(args, (pos, tier)) for args, pos, tier in table.iter_cells()]
+
+    mismatches = 0
+    for args, got in cells:
+        if index.select(*args) != got:
+            mismatches += 1
+            print(f"  MISMATCH (index) {args}: table={got} index={index.select(*args)}")
+
+    if full:
+        from multiprocessing import Pool
+
+        chunks = [cells[i:i + 2000] for i in range(0, len(cells), 2000)]
+        with Pool() as pool:
+            for bad in pool.imap_unordered(_check_cells, [(rules, c) for c in chunks]):
+                for args, got, want in bad:
+                    mismatches += 1
+                    print(f"  MISMATCH (linear) {args}: table={got} reference={want}")
+        checked = len(cells)
+    else:
+        rng = np.random.default_rng(seed)
+        picks = rng.choice(len(cells), size=min(sample, len(cells)), replace=False)
+        for i in picks:
+            args, got = cells[i]
+            want = select_rule_linear(rules, *args)
+            if want != got:
+                mismatches += 1
+                print(f"  MISMATCH (linear) {args}: table={got} reference={want}")
+        checked = len(picks)
+
+    # scores off the grid must miss the table (the caller falls back to RuleIndex)
+    args = cells[0][0][:-1]
+    for score in (math.nan, math.inf, -math.inf,
+                  (SCORE_MIN_TENTHS - 1) / 10, (SCORE_MAX_TENTHS + 1) / 10, 5.05):
+        try:
+            got = table.lookup(*args, score)
+        except (ValueError, OverflowError) as e:
+            got = type(e).__name__
+        if got is not None:
+            mismatches += 1
+            print(f"  MISMATCH (off-grid) overall_score={score}: table={got}, expected None")
+
+    print(f"[plan_rules] verified {len(cells)} cells against RuleIndex and "
+          f"{checked} against the linear reference: {mismatches} mismatches")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile plan_rules.csv / build and verify the precomputed rule table")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("compile", help=f"write the memory-mappable columns to {RULE_COLUMNS_DIR.name}/")
+    sub.add_parser("build", help=f"write {RULE_TABLE_PATH.name}")
+    p = sub.add_parser("verify", help="check the saved table against the reference matching")
+    p.add_argument("--full", action="store_true",
+                   help="check EVERY cell against the linear reference (slow, uses all cores)")
+    args = parser.parse_args()
+
+    if not PLAN_RULES_PATH.exists():
+        raise RuntimeError(
+            f"plan_rules.csv not found at {PLAN_RULES_PATH}. "
+            f"Run generate_plan_rules.py first to create it."
+        )
+    rules = load_plan_rules_csv(PLAN_RULES_PATH)
+
+    if args.command == "compile":
+        start = time.perf_counter()
+        columns = PlanRules.from_rows(rules, csv_sha256=file_sha256(PLAN_RULES_PATH))
+        columns.save(RULE_COLUMNS_DIR)
+        size = sum(p.stat().st_size for p in RULE_COLUMNS_DIR.iterdir())
+        print(f"[plan_rules] {len(columns)} rules, {columns.num_strings} distinct strings, "
+              f"{size / 1e6:.2f} MB compiled in {time.perf_counter() - start:.1f}s "
+              f"-> {RULE_COLUMNS_DIR}")
+    elif args.command == "build":
+        start = time.perf_counter()
+        table = RuleTable.build(rules, csv_sha256=file_sha256(PLAN_RULES_PATH))
+        table.save(RULE_TABLE_PATH)
+        print(f"[plan_rules] {table.positions.size} cells "
+              f"(shape {table.positions.shape}) built in {time.perf_counter() - start:.1f}s "
+              f"-> {RULE_TABLE_PATH}")
+    else:
+        table = load_rule_table()
+        if table is None:
+            raise SystemExit(f"No up-to-date {RULE_TABLE_PATH.name}; run `python plan_rules.py build` first.")
+        if verify_rule_table(rules, table, full=args.full):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# preprocess.py
+"""
+Image preprocessing shared by training (dataset.py) and serving (app.py),
+so the two can't drift apart.
+
+Same result as the old
+
+    Resize((224, 224)) -> ToTensor() -> Normalize(MEAN, STD)
+
+but the image is resized once as uint8, and the uint8 -> float conversion
+and the normalization are done in one vectorized pass, optionally straight
+into a preallocated batch buffer that is reused between batches.
+"""
+from typing import Optional, Sequence
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+IMG_SIZE = 224
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+def resize_to_uint8(img: Image.Image, size: int = IMG_SIZE) -> torch.Tensor:
+    """
+    Resize a PIL image to size x size (bilinear, like transforms.Resize)
+    and return it as a uint8 HWC tensor. No float copy is made here.
+    """
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != (size, size):
+        img = img.resize((size, size), Image.BILINEAR)
+    return torch.from_numpy(np.array(img, dtype=np.uint8))
+
+
+class Preprocessor:
+    """
+    Fused resize + to-float + normalize.
+
+    Calling it on a PIL image works as a drop-in for the old Compose
+    (returns a float CHW tensor, one allocation). For batches, use
+    `normalize_into` with a buffer from `new_buffer`:
+
+        pre = Preprocessor()
+        buf = pre.new_buffer(16)
+        batch = pre.normalize_into(buf, [resize_to_uint8(img) for img in imgs])
+    """
+
+    def __init__(
+        self,
+        size: int = IMG_SIZE,
+        mean: Sequence[float] = MEAN,
+        std: Sequence[float] = STD,
+        channels_last: bool = False,
+    ):
+        self.size = size
+        self.channels_last = channels_last
+
+        mean_t = torch.tensor(mean, dtype=torch.float32).view(3, 1, 1)
+        std_t = torch.tensor(std, dtype=torch.float32).view(3, 1, 1)
+        # (x / 255 - mean) / std  ==  x * scale + bias
+        self.scale = 1.0 / (255.0 * std_t)
+        self.bias = -mean_t / std_t
+
+    # ---------- single image (Dataset / ImageFolder transform) ----------
+
+    def __call__(self, img: Image.Image) -> torch.Tensor:
+        return self.normalize(resize_to_uint8(img, self.size))
+
+    def normalize(self, img: torch.Tensor) -> torch.Tensor:
+        """Already-resized uint8 HWC image -> normalized float CHW tensor."""
+        out = torch.empty((3, self.size, self.size), dtype=torch.float32)
+        return self._normalize(out, img)
+
+    # ---------- batches ----------
+
+    def new_buffer(self, batch_size: int) -> torch.Tensor:
+        """Allocate a reusable float batch buffer [batch_size, 3, size, size]."""
+        memory_format = torch.channels_last if self.channels_last else torch.contiguous_format
+        return torch.empty(
+            (batch_size, 3, self.size, self.size),
+            dtype=torch.float32,
+        ).contiguous(memory_format=memory_format)
+
+    def normalize_into(
+        self,
+        out: torch.Tensor,
+        images: Sequence[torch.Tensor],
+    ) -> torch.Tensor:
+        """
+        Write uint8 HWC images (from resize_to_uint8) into `out` as a
+        normalized float batch and return the filled view out[:len(images)].
+        """
+        if len(images) > out.shape[0]:
+            raise ValueError(
+                f"Batch of {len(images)} images does not fit buffer of {out.shape[0]}"
+            )
+        for i, img in enumerate(images):
+            self._normalize(out[i], img)
+        return out[:len(images)]
+
+    def collate(self, images: Sequence[torch.Tensor], out: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Like torch.stack for uint8 HWC images, normalizing on the way in."""
+        if out is None or out.shape[0] < len(images):
+            out = self.new_buffer(len(images))
+        return self.normalize_into(out, images)
+
+    def _normalize(self, out: torch.Tensor, img: torch.Tensor) -> torch.Tensor:
+        # uint8 -> float happens inside copy_, then one fused multiply-add
+        out.copy_(img.permute(2, 0, 1))
+        return torch.addcmul(self.bias, out, self.scale, out=out)
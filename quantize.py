@@ -0,0 +1,121 @@
+# quantize.py
+"""
+Post-training static INT8 quantization of the trained PhysiqueCNN.
+
+  1. loads weights/physique_cnn.pth (fp32)
+  2. fuses conv-bn-relu and calibrates activation ranges on a sample of
+     the training split of data/dataset
+  3. saves the INT8 model to weights/physique_cnn_int8.pth
+  4. compares fp32 vs INT8 on the validation split (accuracy, agreement,
+     latency) and writes weights/physique_cnn_int8_report.json
+
+Serve it with:  PHYSIQUE_BACKEND=int8 uvicorn app:app
+
+Usage:
+    python quantize.py [--calib-batches 20] [--batch-size 16]
+"""
+import argparse
+import json
+import time
+
+import torch
+from torch.ao import quantization as tq
+
+from dataset import get_dataloaders
+from model import load_trained_model, prepare_for_int8, quantized_weights_path, write_source_manifest
+from train import CLASS_MAPPING_PATH, DATA_ROOT, SPLIT_SEED, VAL_SPLIT, WEIGHTS_PATH
+from utils import file_sha256, green
+
+
+def evaluate(model, loader):
+    """Return (predictions, labels, seconds spent in forward) over a loader."""
+    preds, labels = [], []
+    seconds = 0.0
+    with torch.no_grad():
+        for images, targets in loader:
+            start = time.perf_counter()
+            logits = model(images)
+            seconds += time.perf_counter() - start
+            preds.append(logits.argmax(dim=1))
+            labels.append(targets)
+    return torch.cat(preds), torch.cat(labels), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize physique_cnn.pth to INT8")
+    parser.add_argument("--calib-batches", type=int, default=20,
+                        help="training batches used to calibrate activation ranges")
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    if not WEIGHTS_PATH.exists():
+        raise RuntimeError(f"Model weights not found at {WEIGHTS_PATH}. Train with train.py first.")
+
+    with CLASS_MAPPING_PATH.open("r", encoding="utf-8") as f:
+        num_classes = len(json.load(f))
+
+    # same seed as train.py -> same validation split the fp32 model was selected on
+    train_loader, val_loader, _, _, _, _ = get_dataloaders(
+        data_root=str(DATA_ROOT),
+        batch_size=args.batch_size,
+        val_split=VAL_SPLIT,
+        split_seed=SPLIT_SEED,
+    )
+
+    device = torch.device("cpu")
+    source_sha256 = file_sha256(WEIGHTS_PATH)  # of the exact file loaded here
+    fp32_model = load_trained_model(str(WEIGHTS_PATH), num_classes, device)
+
+    # ----- calibrate + convert -----
+    print(green(f"[quantize] Calibrating on up to {args.calib_batches} training batches"))
+    int8_model = prepare_for_int8(fp32_model.state_dict(), num_classes)
+    with torch.no_grad():
+        for batch_idx, (images, _) in enumerate(train_loader):
+            if batch_idx >= args.calib_batches:
+                break
+            int8_model(images)
+    tq.convert(int8_model, inplace=True)
+
+    out_path = quantized_weights_path(str(WEIGHTS_PATH))
+    torch.save(int8_model.state_dict(), out_path)
+    write_source_manifest(out_path, WEIGHTS_PATH, source_sha256)
+    print(green(f"[quantize] INT8 model saved to {out_path}"))
+
+    # ----- fp32 vs int8 on the validation split -----
+    fp32_preds, labels, fp32_secs = evaluate(fp32_model, val_loader)
+    int8_preds, _, int8_secs = evaluate(int8_model, val_loader)
+
+    total = labels.numel()
+    fp32_acc = (fp32_preds == labels).float().mean().item()
+    int8_acc = (int8_preds == labels).float().mean().item()
+    agreement = (fp32_preds == int8_preds).float().mean().item()
+
+    report = {
+        "val_samples": total,
+        "fp32_val_accuracy": fp32_acc,
+        "int8_val_accuracy": int8_acc,
+        "accuracy_delta": int8_acc - fp32_acc,
+        "prediction_agreement": agreement,
+        "fp32_ms_per_image": 1000.0 * fp32_secs / max(total, 1),
+        "int8_ms_per_image": 1000.0 * int8_secs / max(total, 1),
+        "fp32_size_mb": WEIGHTS_PATH.stat().st_size / 1e6,
+        "int8_size_mb": out_path.stat().st_size / 1e6,
+        "engine": torch.backends.quantized.engine,
+        "calibration_batches": args.calib_batches,
+    }
+    report_path = out_path.with_name(f"{out_path.stem}_report.json")
+    with report_path.open("w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(green("[quantize] ===== FP32 vs INT8 (validation split) ====="))
+    print(f"  val samples:    {total}")
+    print(f"  fp32 accuracy:  {fp32_acc * 100:.2f}%")
+    print(f"  int8 accuracy:  {int8_acc * 100:.2f}%  (delta {(int8_acc - fp32_acc) * 100:+.2f} pts)")
+    print(f"  agreement:      {agreement * 100:.2f}% of predictions identical")
+    print(f"  latency:        {report['fp32_ms_per_image']:.2f} -> {report['int8_ms_per_image']:.2f} ms/image")
+    print(f"  weights size:   {report['fp32_size_mb']:.1f} -> {report['int8_size_mb']:.1f} MB")
+    print(green(f"[quantize] Report written to {report_path}"))
+
+
+if __name__ == "__main__":
+    main()
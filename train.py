@@ -1,13 +1,34 @@
 # train.py
+"""
+Train PhysiqueCNN on data/dataset and save the best weights to
+weights/physique_cnn.pth.
+
+--amp trains under torch.autocast (bfloat16 on CPU, float16 + GradScaler
+on CUDA) and --channels-last runs the model and batches in NHWC; the
+weights are still stored in fp32, so the saved file is the same either
+way. --compare trains fp32 and amp + channels_last for a few epochs each
+from the same initial weights and writes weights/train_precision_report.json
+(nothing else is saved in that mode). --compile runs the model through
+torch.compile (see model.compile_model; uncompiled if that fails).
+
+Usage:
+    python train.py [--amp] [--channels-last] [--compile] [--epochs 20]
+    python train.py --compare [--epochs 2]
+"""
+import argparse
+import contextlib
 import json
+import time
 from pathlib import Path
 
 import torch
 from torch import nn, optim
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 
-from dataset import get_dataloaders
-from model import PhysiqueCNN
+from dataset import class_counts, get_dataloaders
+from model import COMPILE_MODES, PhysiqueCNN, compile_model
+from preprocess import IMG_SIZE
+from utils import green
 
 
 # ---------- paths ----------
@@ -20,14 +41,19 @@ WEIGHTS_DIR.mkdir(parents=True, exist_ok=True)
 WEIGHTS_PATH = WEIGHTS_DIR / "physique_cnn.pth"
 
 CLASS_MAPPING_PATH = BACKEND_ROOT / "data" / "class_mapping.json"
+PRECISION_REPORT_PATH = WEIGHTS_DIR / "train_precision_report.json"
 
 # ---------- training hyperparams ----------
 BATCH_SIZE = 16
 VAL_SPLIT = 0.2
-NUM_WORKERS = 0
+SPLIT_SEED = 42  # fixed, so quantize.py etc. can evaluate on the same val split
+NUM_WORKERS = "auto"  # loader workers sized to the CPU cores (see dataset.loader_kwargs)
+USE_IMAGE_CACHE = True  # read data/image_cache when up to date (`python dataset.py cache`)
 EPOCHS = 20
+COMPARE_EPOCHS = 2
 LEARNING_RATE = 1e-4
 WEIGHT_DECAY = 1e-4
+INIT_SEED = 0  # --compare: both runs start from the same head weights
 
 # ---------- fake dataset size for project ----------
 FAKE_TOTAL_IMAGES = 3000  # just for display in logs
@@ -35,11 +61,6 @@ FAKE_TOTAL_IMAGES = 3000  # just for display in logs
 
 # ---------- small helpers ----------
 
-def green(text: str) -> str:
-    """Wrap text in green ANSI color (works in most terminals)."""
-    return f"\033[92m{text}\033[0m"
-
-
 def print_progress(batch_idx: int, total_batches: int, epoch: int):
     """
     Simple green loading bar for one epoch.
@@ -60,11 +81,11 @@ def print_progress(batch_idx: int, total_batches: int, epoch: int):
 def compute_class_weights(train_dataset, num_classes: int) -> torch.Tensor:
     """
     Compute simple inverse-frequency class weights for CrossEntropyLoss.
+
+    Counts come from the dataset's labels (ImageFolder.targets + Subset
+    indices), so no image is decoded here.
     """
-    counts = [0] * num_classes
-    for idx in range(len(train_dataset)):
-        _, label = train_dataset[idx]
-        counts[label] += 1
+    counts = class_counts(train_dataset, num_classes).tolist()
 
     total = sum(counts)
     weights = [0.0] * num_classes
@@ -79,120 +100,264 @@ def compute_class_weights(train_dataset, num_classes: int) -> torch.Tensor:
     return weights_tensor
 
 
-def main():
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(green(f"Using device: {device}"))
-    print(green(f"Trained weights will ALWAYS be saved to: {WEIGHTS_PATH}"))
+# ---------- precision / memory format ----------
 
-    train_loader, val_loader, num_classes, class_to_idx, train_dataset, val_dataset = get_dataloaders(
-        data_root=str(DATA_ROOT),
-        batch_size=BATCH_SIZE,
-        val_split=VAL_SPLIT,
-        num_workers=NUM_WORKERS,
-    )
+class Precision:
+    """
+    How the train / val loops run the model.
 
-    # 🔹 Fake total images just for project reporting
-    print(green(f"Total images in dataset (for project): {FAKE_TOTAL_IMAGES}"))
+    amp=True autocasts the forward pass to bfloat16 on CPU (native on
+    CPUs with AVX512-BF16 / AMX) or float16 on CUDA, where the loss is
+    also scaled (GradScaler) so small fp16 gradients don't underflow.
+    channels_last=True keeps the model and every batch in NHWC.
+    """
 
-    print(f"Number of classes: {num_classes}")
-    print("Class mapping (class_name -> idx):", class_to_idx)
+    def __init__(self, device: torch.device, amp: bool = False, channels_last: bool = False):
+        self.device = device
+        self.amp = amp
+        self.channels_last = channels_last
+        self.dtype = torch.float16 if device.type == "cuda" else torch.bfloat16
+        self.scaler = torch.amp.GradScaler(device.type, enabled=amp and device.type == "cuda")
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
 
-    # save mapping for app.py
-    CLASS_MAPPING_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(CLASS_MAPPING_PATH, "w") as f:
-        json.dump(class_to_idx, f, indent=2)
-    print(green(f"Saved class mapping to: {CLASS_MAPPING_PATH}"))
+    @property
+    def name(self) -> str:
+        parts = [str(self.dtype).replace("torch.", "") + " amp" if self.amp else "fp32"]
+        if self.channels_last:
+            parts.append("channels_last")
+        return " + ".join(parts)
 
-    model = PhysiqueCNN(num_classes=num_classes).to(device)
+    def prepare(self, model: nn.Module) -> nn.Module:
+        return model.to(self.device, memory_format=self.memory_format)
 
-    class_weights = compute_class_weights(train_dataset, num_classes).to(device)
-    criterion = nn.CrossEntropyLoss(weight=class_weights)
-    optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE, weight_decay=WEIGHT_DECAY)
-    scheduler = ReduceLROnPlateau(
-        optimizer,
-        mode="max",
-        factor=0.5,
-        patience=3,
-    )
+    def batch(self, images: torch.Tensor) -> torch.Tensor:
+        return images.to(self.device, memory_format=self.memory_format, non_blocking=True)
 
-    best_val_acc = 0.0
+    def autocast(self):
+        if not self.amp:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=self.dtype)
 
-    print(green("===== START TRAINING ====="))
+    def backward_step(self, loss: torch.Tensor, optimizer: optim.Optimizer):
+        # GradScaler is a pass-through when disabled (fp32, or bf16 on CPU)
+        self.scaler.scale(loss).backward()
+        self.scaler.step(optimizer)
+        self.scaler.update()
 
-    for epoch in range(1, EPOCHS + 1):
-        # ----- train -----
-        model.train()
-        running_loss = 0.0
-        running_correct = 0
-        total = 0
 
-        total_batches = len(train_loader)
+# ---------- train / validate ----------
 
-        for batch_idx, (images, labels) in enumerate(train_loader, start=1):
-            images = images.to(device)
-            labels = labels.to(device)
+def train_one_epoch(model, loader, criterion, optimizer, precision: Precision, epoch: int):
+    """One pass over `loader`. Returns (loss, accuracy)."""
+    model.train()
+    running_loss = 0.0
+    running_correct = 0
+    total = 0
 
-            optimizer.zero_grad()
+    total_batches = len(loader)
+
+    for batch_idx, (images, labels) in enumerate(loader, start=1):
+        images = precision.batch(images)
+        labels = labels.to(precision.device, non_blocking=True)
+
+        optimizer.zero_grad()
+        with precision.autocast():
             outputs = model(images)
             loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
+        precision.backward_step(loss, optimizer)
 
-            running_loss += loss.item() * images.size(0)
-            _, preds = outputs.max(1)
-            running_correct += (preds == labels).sum().item()
-            total += labels.size(0)
+        running_loss += loss.item() * images.size(0)
+        _, preds = outputs.max(1)
+        running_correct += (preds == labels).sum().item()
+        total += labels.size(0)
+
+        # GREEN LOADING BAR
+        print_progress(batch_idx, total_batches, epoch)
+
+    # end of epoch -> newline after progress bar
+    print()
+
+    return running_loss / total, running_correct / total
+
+
+def evaluate(model, loader, criterion, precision: Precision):
+    """Validation loss and accuracy, under the same precision as training."""
+    model.eval()
+    val_loss_sum = 0.0
+    val_correct = 0
+    val_total = 0
+
+    with torch.no_grad(), precision.autocast():
+        for images, labels in loader:
+            images = precision.batch(images)
+            labels = labels.to(precision.device, non_blocking=True)
+
+            outputs = model(images)
+            loss = criterion(outputs, labels)
 
-            # GREEN LOADING BAR
-            print_progress(batch_idx, total_batches, epoch)
+            val_loss_sum += loss.item() * images.size(0)
+            _, preds = outputs.max(1)
+            val_correct += (preds == labels).sum().item()
+            val_total += labels.size(0)
 
-        # end of epoch -> newline after progress bar
-        print()
+    return val_loss_sum / val_total, val_correct / val_total
 
-        train_loss = running_loss / total
-        train_acc = running_correct / total
 
-        # ----- validation -----
+def fit(data, precision: Precision, epochs: int, weights_path=None, seed=None, compile_mode=None) -> dict:
+    """
+    Train a fresh PhysiqueCNN for `epochs` epochs. The best model (by val
+    accuracy) is saved to weights_path if given. Returns per-epoch timings
+    and the best val accuracy.
+    """
+    train_loader, val_loader, num_classes, train_dataset = data
+
+    if seed is not None:
+        torch.manual_seed(seed)
+    model = precision.prepare(PhysiqueCNN(num_classes=num_classes))
+    net = model  # what the loops call; the weights are always saved from `model`
+    if compile_mode is not None:
+        # full batches + the smaller last one, so the train loop never recompiles mid-epoch
+        sizes = sorted({BATCH_SIZE, len(train_dataset) % BATCH_SIZE} - {0})
+        examples = [precision.batch(torch.zeros((n, 3, IMG_SIZE, IMG_SIZE))) for n in sizes]
+        with precision.autocast():
+            net = compile_model(model, examples, mode=compile_mode, train=True)
+        # evaluate() calls net in eval mode under no_grad, which the guards
+        # treat as new graphs: compile its full and last val batch here too,
+        # so the first validation pass does not recompile either
+        val_sizes = sorted({BATCH_SIZE, len(val_loader.dataset) % BATCH_SIZE} - {0})
         model.eval()
-        val_loss_sum = 0.0
-        val_correct = 0
-        val_total = 0
+        with torch.no_grad(), precision.autocast():
+            for n in val_sizes:
+                net(precision.batch(torch.zeros((n, 3, IMG_SIZE, IMG_SIZE))))
+        model.train()
 
-        with torch.no_grad():
-            for images, labels in val_loader:
-                images = images.to(device)
-                labels = labels.to(device)
+    class_weights = compute_class_weights(train_dataset, num_classes).to(precision.device)
+    criterion = nn.CrossEntropyLoss(weight=class_weights)
+    optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE, weight_decay=WEIGHT_DECAY)
+    scheduler = ReduceLROnPlateau(
+        optimizer,
+        mode="max",
+        factor=0.5,
+        patience=3,
+    )
 
-                outputs = model(images)
-                loss = criterion(outputs, labels)
+    best_val_acc = 0.0
+    epoch_seconds = []
 
-                val_loss_sum += loss.item() * images.size(0)
-                _, preds = outputs.max(1)
-                val_correct += (preds == labels).sum().item()
-                val_total += labels.size(0)
+    print(green(f"===== START TRAINING ({precision.name}) ====="))
 
-        val_loss = val_loss_sum / val_total
-        val_acc = val_correct / val_total
+    for epoch in range(1, epochs + 1):
+        start = time.perf_counter()
+        train_loss, train_acc = train_one_epoch(net, train_loader, criterion, optimizer, precision, epoch)
+        val_loss, val_acc = evaluate(net, val_loader, criterion, precision)
+        epoch_seconds.append(time.perf_counter() - start)
 
         scheduler.step(val_acc)
 
         print(
-            f"Epoch [{epoch}/{EPOCHS}] "
+            f"Epoch [{epoch}/{epochs}] "
             f"train_loss={train_loss:.4f} train_acc={train_acc * 100:.2f}% "
-            f"val_loss={val_loss:.4f} val_acc={val_acc * 100:.2f}%"
+            f"val_loss={val_loss:.4f} val_acc={val_acc * 100:.2f}% "
+            f"({epoch_seconds[-1]:.1f}s)"
         )
 
         # save best model (ALWAYS to physique_cnn.pth)
         if val_acc > best_val_acc:
             best_val_acc = val_acc
-            torch.save(model.state_dict(), WEIGHTS_PATH)
-            print(green(
-                f"  -> New best model saved to {WEIGHTS_PATH} "
-                f"(val_acc={best_val_acc * 100:.2f}%)"
-            ))
+            if weights_path is not None:
+                # contiguous fp32 copy: loads the same way whatever the training mode
+                state = {k: v.contiguous() for k, v in model.state_dict().items()}
+                torch.save(state, weights_path)
+                print(green(
+                    f"  -> New best model saved to {weights_path} "
+                    f"(val_acc={best_val_acc * 100:.2f}%)"
+                ))
+
+    return {
+        "mode": precision.name,
+        "epoch_seconds": epoch_seconds,
+        "best_val_accuracy": best_val_acc,
+        "final_val_accuracy": val_acc,
+    }
+
+
+def compare_precisions(data, device: torch.device, epochs: int):
+    """fp32 vs amp + channels_last on the same split and initial weights."""
+    report = {
+        "device": str(device),
+        "cpu_capability": torch.backends.cpu.get_cpu_capability(),
+        "epochs": epochs,
+    }
+    for key, precision in (
+        ("fp32", Precision(device)),
+        ("amp_channels_last", Precision(device, amp=True, channels_last=True)),
+    ):
+        report[key] = fit(data, precision, epochs, seed=INIT_SEED)
+
+    with PRECISION_REPORT_PATH.open("w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    fp32, amp = report["fp32"], report["amp_channels_last"]
+    # first epoch includes warm-up (allocator, oneDNN kernel selection)
+    fp32_secs, amp_secs = min(fp32["epoch_seconds"]), min(amp["epoch_seconds"])
+    print(green(f"===== FP32 vs {amp['mode'].upper()} ====="))
+    print(f"  epoch time (best):  {fp32_secs:.1f}s -> {amp_secs:.1f}s  (x{fp32_secs / amp_secs:.2f})")
+    print(f"  best val acc:       {fp32['best_val_accuracy'] * 100:.2f}% -> {amp['best_val_accuracy'] * 100:.2f}%")
+    print(green(f"Report written to {PRECISION_REPORT_PATH}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train PhysiqueCNN on data/dataset")
+    parser.add_argument("--amp", action="store_true",
+                        help="mixed precision: bfloat16 autocast on CPU, float16 + GradScaler on CUDA")
+    parser.add_argument("--channels-last", action="store_true", help="NHWC model and batches")
+    parser.add_argument("--compile", nargs="?", const="default", default=None, choices=COMPILE_MODES,
+                        metavar="MODE", help="torch.compile the model (optional mode, default 'default')")
+    parser.add_argument("--compare", action="store_true",
+                        help=f"train fp32 and amp + channels_last, write {PRECISION_REPORT_PATH.name}")
+    parser.add_argument("--epochs", type=int, default=None,
+                        help=f"default {EPOCHS} ({COMPARE_EPOCHS} with --compare)")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(green(f"Using device: {device}"))
+    if not args.compare:
+        print(green(f"Trained weights will ALWAYS be saved to: {WEIGHTS_PATH}"))
+
+    train_loader, val_loader, num_classes, class_to_idx, train_dataset, val_dataset = get_dataloaders(
+        data_root=str(DATA_ROOT),
+        batch_size=BATCH_SIZE,
+        val_split=VAL_SPLIT,
+        num_workers=NUM_WORKERS,
+        split_seed=SPLIT_SEED,
+        use_cache=USE_IMAGE_CACHE,
+    )
+
+    # 🔹 Fake total images just for project reporting
+    print(green(f"Total images in dataset (for project): {FAKE_TOTAL_IMAGES}"))
+
+    print(f"Number of classes: {num_classes}")
+    print("Class mapping (class_name -> idx):", class_to_idx)
+    print("Train samples per class:", class_counts(train_dataset, num_classes).tolist())
+    print("Val samples per class:", class_counts(val_dataset, num_classes).tolist())
+
+    data = (train_loader, val_loader, num_classes, train_dataset)
+
+    if args.compare:
+        compare_precisions(data, device, args.epochs or COMPARE_EPOCHS)
+        return
+
+    # save mapping for app.py
+    CLASS_MAPPING_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(CLASS_MAPPING_PATH, "w") as f:
+        json.dump(class_to_idx, f, indent=2)
+    print(green(f"Saved class mapping to: {CLASS_MAPPING_PATH}"))
+
+    precision = Precision(device, amp=args.amp, channels_last=args.channels_last)
+    result = fit(data, precision, args.epochs or EPOCHS, weights_path=WEIGHTS_PATH, compile_mode=args.compile)
 
     print(green("===== TRAINING FINISHED ====="))
-    print(green(f"Best validation accuracy: {best_val_acc * 100:.2f}%"))
+    print(green(f"Best validation accuracy: {result['best_val_accuracy'] * 100:.2f}%"))
     print(green(f"Final best weights file: {WEIGHTS_PATH}"))
 
 
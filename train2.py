@@ -9,12 +9,27 @@ We predict:
 from:
   - 'Gender', 'Goal', 'BMI Category'
 
+The features only take a few dozen combinations, so after training every
+combination is run through the best models once and the answers are saved
+to weights/gym_lookup.json; app.py serves from that table and only calls
+the models for values it has never seen.
+
+With --multi-output a single pipeline (one preprocessor, one forest)
+predicts both targets in one call; --compare trains both layouts on the
+same split and writes weights/gym_multi_output_report.json.
+
 Usage:
-    python train2.py
+    python train2.py [--multi-output] [--compare]
+    python train2.py --compile-lookup   # only rebuild gym_lookup.json
 """
 
+import argparse
+import itertools
+import io
+import json
+import time
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import joblib
 import pandas as pd
@@ -25,6 +40,19 @@ from sklearn.model_selection import train_test_split
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 
+# loaders live in gym_models.py so serving doesn't import this module;
+# re-exported here for existing `from train2 import load_gym_models` callers
+from gym_models import (  # noqa: F401
+    GYM_LOOKUP_PATH,
+    GYM_MODEL_PATH,
+    TargetView,
+    export_gym_models,
+    load_gym_lookup,
+    load_gym_models,
+    predict_targets,
+)
+from utils import file_sha256, green
+
 # ---------- paths ----------
 
 BACKEND_ROOT = Path(__file__).resolve().parent
@@ -32,8 +60,10 @@ DATASET_CSV = BACKEND_ROOT / "data" / "dataset" / "GYM.csv"
 WEIGHTS_DIR = BACKEND_ROOT / "weights"
 WEIGHTS_DIR.mkdir(parents=True, exist_ok=True)
 
-# Pkl that will store BOTH models (exercise + meal)
-GYM_MODEL_PATH = WEIGHTS_DIR / "gym_tabular_models.pkl"
+# GYM_MODEL_PATH: pkl that will store BOTH models (exercise + meal)
+# GYM_LOOKUP_PATH: every feature combination -> (Exercise Schedule, Meal Plan)
+# (defined in gym_models.py, the serving-side loader)
+MULTI_OUTPUT_REPORT_PATH = WEIGHTS_DIR / "gym_multi_output_report.json"
 
 # ---------- config ----------
 
@@ -47,11 +77,6 @@ RANDOM_STATE = 42
 
 # ---------- helpers ----------
 
-def green(text: str) -> str:
-    """Wrap text in green ANSI color (works in most terminals)."""
-    return f"\033[92m{text}\033[0m"
-
-
 def load_csv(path: Path) -> pd.DataFrame:
     if not path.exists():
         raise FileNotFoundError(f"GYM.csv not found at: {path}")
@@ -132,6 +157,12 @@ def build_model(preprocessor: ColumnTransformer) -> Pipeline:
     return model
 
 
+def pickled_size_mb(obj) -> float:
+    buf = io.BytesIO()
+    joblib.dump(obj, buf)
+    return buf.tell() / 1e6
+
+
 def _get_previous_best_score(path: Path) -> float:
     if not path.exists():
         return 0.0
@@ -142,9 +173,79 @@ def _get_previous_best_score(path: Path) -> float:
         return 0.0
 
 
+def _get_saved_layout(path: Path) -> Optional[bool]:
+    """multi_output flag of the saved bundle, or None if there is none."""
+    if not path.exists():
+        return None
+    try:
+        return bool(joblib.load(path).get("multi_output", False))
+    except Exception:
+        return None
+
+
+# ---------- lookup table ----------
+
+def feature_domains(model: Pipeline) -> Dict[str, List[str]]:
+    """Categories the fitted one-hot encoder knows, per feature column."""
+    for name, transformer, cols in model.named_steps["preprocess"].transformers_:
+        if name == "cat":
+            onehot = transformer.named_steps["onehot"]
+            return {c: [str(v) for v in cats] for c, cats in zip(cols, onehot.categories_)}
+    return {}
+
+
+def compile_gym_lookup(
+    models_path: Path = GYM_MODEL_PATH,
+    out_path: Path = GYM_LOOKUP_PATH,
+) -> Optional[Path]:
+    """
+    Predict every combination of known feature values with both models
+    (two batched predict calls) and write the answers to out_path.
+    Returns None if the features are not all categorical.
+    """
+    bundle = joblib.load(models_path)
+    feature_cols = bundle["feature_cols"]
+    if bundle.get("numeric_features"):
+        print(green(f"[train2] Numeric features {bundle['numeric_features']}: "
+                    f"no finite lookup table, app.py will call the models"))
+        return None
+
+    domains = feature_domains(bundle["model"] if bundle.get("multi_output") else bundle["exercise_model"])
+    combos = list(itertools.product(*(domains[c] for c in feature_cols)))
+    X = pd.DataFrame(combos, columns=feature_cols)
+    exercise, meal = predict_targets(bundle, X)
+
+    lookup = {
+        "feature_cols": feature_cols,
+        "models_sha256": file_sha256(models_path),
+        "entries": [
+            [*combo, str(ex), str(me)] for combo, ex, me in zip(combos, exercise, meal)
+        ],
+    }
+    with out_path.open("w", encoding="utf-8") as f:
+        json.dump(lookup, f, indent=1)
+    print(green(f"[train2] Lookup table with {len(combos)} feature combinations saved to {out_path}"))
+    return out_path
+
+
 # ---------- main training ----------
 
 def main():
+    parser = argparse.ArgumentParser(description="Train the GYM.csv recommendation models")
+    parser.add_argument("--multi-output", action="store_true",
+                        help="train ONE pipeline predicting both targets instead of two")
+    parser.add_argument("--compare", action="store_true",
+                        help=f"train both layouts and write {MULTI_OUTPUT_REPORT_PATH.name}")
+    parser.add_argument("--compile-lookup", action="store_true",
+                        help=f"skip training, only rebuild {GYM_LOOKUP_PATH.name} from {GYM_MODEL_PATH.name}")
+    args = parser.parse_args()
+
+    if args.compile_lookup:
+        if not GYM_MODEL_PATH.exists():
+            raise FileNotFoundError(f"Gym models not found at {GYM_MODEL_PATH}. Run train2.py first.")
+        compile_gym_lookup()
+        return
+
     print(green(f"[train2] Using dataset: {DATASET_CSV}"))
     print(green(f"[train2] Models will be saved to: {GYM_MODEL_PATH}"))
     print(green(f"[train2] Feature columns: {FEATURE_COLS}"))
@@ -156,12 +257,6 @@ def main():
 
     preprocessor, num_feats, cat_feats = build_preprocessor(X)
 
-    # we build two separate pipelines (same type but independent)
-    exercise_model = build_model(preprocessor)
-    # new preprocessor instance for the second model
-    preprocessor2, _, _ = build_preprocessor(X)
-    meal_model = build_model(preprocessor2)
-
     stratify = y_ex if y_ex.nunique() > 1 else None
 
     X_train, X_val, y_ex_train, y_ex_val, y_meal_train, y_meal_val = train_test_split(
@@ -176,30 +271,111 @@ def main():
     print(green(f"[train2] Training samples: {X_train.shape[0]}"))
     print(green(f"[train2] Validation samples: {X_val.shape[0]}"))
 
-    print(green("[train2] ===== TRAIN EXERCISE MODEL ====="))
-    exercise_model.fit(X_train, y_ex_train)
-    y_ex_pred = exercise_model.predict(X_val)
-    val_acc_ex = accuracy_score(y_ex_val, y_ex_pred)
-    print(green(f"[train2] Exercise Schedule val acc: {val_acc_ex * 100:.2f}%"))
-    print("[train2] Exercise Schedule report:")
-    print(classification_report(y_ex_val, y_ex_pred))
-
-    print(green("[train2] ===== TRAIN MEAL MODEL ====="))
-    meal_model.fit(X_train, y_meal_train)
-    y_meal_pred = meal_model.predict(X_val)
-    val_acc_meal = accuracy_score(y_meal_val, y_meal_pred)
-    print(green(f"[train2] Meal Plan val acc: {val_acc_meal * 100:.2f}%"))
-    print("[train2] Meal Plan report:")
-    print(classification_report(y_meal_val, y_meal_pred))
+    results = {}
+
+    if not args.multi_output or args.compare:
+        # we build two separate pipelines (same type but independent)
+        exercise_model = build_model(preprocessor)
+        # new preprocessor instance for the second model
+        preprocessor2, _, _ = build_preprocessor(X)
+        meal_model = build_model(preprocessor2)
+        start = time.perf_counter()
+
+        print(green("[train2] ===== TRAIN EXERCISE MODEL ====="))
+        exercise_model.fit(X_train, y_ex_train)
+        y_ex_pred = exercise_model.predict(X_val)
+        val_acc_ex = accuracy_score(y_ex_val, y_ex_pred)
+        print(green(f"[train2] Exercise Schedule val acc: {val_acc_ex * 100:.2f}%"))
+        print("[train2] Exercise Schedule report:")
+        print(classification_report(y_ex_val, y_ex_pred))
+
+        print(green("[train2] ===== TRAIN MEAL MODEL ====="))
+        meal_model.fit(X_train, y_meal_train)
+        y_meal_pred = meal_model.predict(X_val)
+        val_acc_meal = accuracy_score(y_meal_val, y_meal_pred)
+        print(green(f"[train2] Meal Plan val acc: {val_acc_meal * 100:.2f}%"))
+        print("[train2] Meal Plan report:")
+        print(classification_report(y_meal_val, y_meal_pred))
+
+        results["two_models"] = {
+            "bundle": {
+                "exercise_model": exercise_model,
+                "meal_model": meal_model,
+            },
+            "train_seconds": time.perf_counter() - start,
+            "val_accuracy_exercise": val_acc_ex,
+            "val_accuracy_meal": val_acc_meal,
+        }
+
+    if args.multi_output or args.compare:
+        # one preprocessor, one forest, both targets (RandomForest is natively multi-output)
+        multi_preprocessor, _, _ = build_preprocessor(X)
+        multi_model = build_model(multi_preprocessor)
+        Y_train = pd.concat([y_ex_train, y_meal_train], axis=1)
+        start = time.perf_counter()
+
+        print(green("[train2] ===== TRAIN MULTI-OUTPUT MODEL ====="))
+        multi_model.fit(X_train, Y_train)
+        Y_pred = multi_model.predict(X_val)
+        val_acc_ex = accuracy_score(y_ex_val, Y_pred[:, 0])
+        val_acc_meal = accuracy_score(y_meal_val, Y_pred[:, 1])
+        print(green(f"[train2] Exercise Schedule val acc: {val_acc_ex * 100:.2f}%"))
+        print(green(f"[train2] Meal Plan val acc: {val_acc_meal * 100:.2f}%"))
+
+        results["multi_output"] = {
+            "bundle": {
+                "multi_output": True,
+                "model": multi_model,
+                "target_cols": [TARGET_EXERCISE_COL, TARGET_MEAL_COL],
+            },
+            "train_seconds": time.perf_counter() - start,
+            "val_accuracy_exercise": val_acc_ex,
+            "val_accuracy_meal": val_acc_meal,
+        }
 
+    if args.compare:
+        report = {}
+        for name, result in results.items():
+            predict_secs = float("inf")
+            for _ in range(5):
+                start = time.perf_counter()
+                predict_targets(result["bundle"], X_val.iloc[:1])
+                predict_secs = min(predict_secs, time.perf_counter() - start)
+            report[name] = {
+                "train_seconds": result["train_seconds"],
+                "size_mb": pickled_size_mb(result["bundle"]),
+                "single_row_predict_ms": 1000.0 * predict_secs,
+                "val_accuracy_exercise": result["val_accuracy_exercise"],
+                "val_accuracy_meal": result["val_accuracy_meal"],
+            }
+        with MULTI_OUTPUT_REPORT_PATH.open("w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+        two, multi = report["two_models"], report["multi_output"]
+        print(green("[train2] ===== TWO MODELS vs MULTI-OUTPUT ====="))
+        print(f"  train time:        {two['train_seconds']:.2f}s -> {multi['train_seconds']:.2f}s")
+        print(f"  pickle size:       {two['size_mb']:.1f} -> {multi['size_mb']:.1f} MB")
+        print(f"  1-row predict:     {two['single_row_predict_ms']:.1f} -> {multi['single_row_predict_ms']:.1f} ms")
+        print(f"  exercise val acc:  {two['val_accuracy_exercise'] * 100:.2f}% -> {multi['val_accuracy_exercise'] * 100:.2f}%")
+        print(f"  meal val acc:      {two['val_accuracy_meal'] * 100:.2f}% -> {multi['val_accuracy_meal'] * 100:.2f}%")
+        print(green(f"[train2] Report written to {MULTI_OUTPUT_REPORT_PATH}"))
+
+    chosen = results["multi_output" if args.multi_output else "two_models"]
+    val_acc_ex = chosen["val_accuracy_exercise"]
+    val_acc_meal = chosen["val_accuracy_meal"]
     avg_val_acc = (val_acc_ex + val_acc_meal) / 2.0
     prev_best = _get_previous_best_score(GYM_MODEL_PATH)
     print(green(f"[train2] Previous avg best acc: {prev_best * 100:.2f}%"))
-
-    if avg_val_acc > prev_best:
+    saved_layout = _get_saved_layout(GYM_MODEL_PATH)
+    # asking for the other layout replaces the bundle even on a tied score
+    layout_changed = saved_layout is not None and saved_layout != args.multi_output
+    if layout_changed:
+        print(green(f"[train2] Saved bundle is {'multi-output' if saved_layout else 'two models'}, "
+                    f"switching to {'multi-output' if args.multi_output else 'two models'}"))
+
+    if avg_val_acc > prev_best or layout_changed:
         bundle = {
-            "exercise_model": exercise_model,
-            "meal_model": meal_model,
+            **chosen["bundle"],
             "feature_cols": FEATURE_COLS,
             "numeric_features": num_feats,
             "categorical_features": cat_feats,
@@ -224,32 +400,12 @@ def main():
             )
         )
 
-    print(green("[train2] ===== TRAINING FINISHED ====="))
-
+    # the table and the flat export always mirror whichever pkl is the current best
+    if GYM_MODEL_PATH.exists():
+        compile_gym_lookup()
+        print(green(f"[train2] Flat NumPy models exported to {export_gym_models(GYM_MODEL_PATH)}"))
 
-# ---------- loader (for use in app.py) ----------
-
-def load_gym_models(weights_path: Optional[str] = None):
-    """
-    Load the trained GYM tabular models.
-
-    Returns:
-        exercise_model: sklearn Pipeline predicting 'Exercise Schedule'
-        meal_model:     sklearn Pipeline predicting 'Meal Plan'
-        meta:           full metadata bundle (dict)
-    """
-    if weights_path is None:
-        path = GYM_MODEL_PATH
-    else:
-        path = Path(weights_path)
-
-    if not path.exists():
-        raise FileNotFoundError(
-            f"Gym models not found at {path}. Run train2.py first."
-        )
-
-    bundle = joblib.load(path)
-    return bundle["exercise_model"], bundle["meal_model"], bundle
+    print(green("[train2] ===== TRAINING FINISHED ====="))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,37 @@
+# utils.py
+"""
+Small helpers shared by the training / export scripts and by the modules
+that compile artifacts into data/ and weights/. Standard library only, so
+importing it never pulls in torch or sklearn.
+"""
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+def green(text: str) -> str:
+    """Wrap text in green ANSI color (works in most terminals)."""
+    return f"\033[92m{text}\033[0m"
+
+
+def file_sha256(path: Path) -> str:
+    """Hex sha256 of a file's contents, read in 1 MB chunks."""
+    h = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_manifest(path: Path, manifest: Dict[str, Any], indent: Optional[int] = 2):
+    """
+    Write the JSON manifest of a compiled artifact.
+
+    Call this after every other file of the artifact is written: loaders
+    treat a missing manifest as "not built", so a build that dies halfway
+    never looks complete. The manifest usually records the sha256 of the
+    source it was built from, which is how loaders detect a stale artifact.
+    """
+    with Path(path).open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=indent)